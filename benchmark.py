@@ -0,0 +1,344 @@
+# encoding: utf-8
+
+'''
+Benchmarks for the preprocessing (phonproc.py) and embedding
+analysis (wordvecutil.py) hot paths, on synthetic data
+benchmark.py [--sizes N,N,...] [--vectors N,N,...] [--dim D] [--repeat R]
+	[--only NAME,NAME,...] [--save FILE] [--compare FILE] [--tolerance T]
+
+Transcription lines (LANG⦀TRANSCRIPTION, as written by wiki_parse.py)
+are generated from the language names in langs.store, with symbols
+drawn from the phonproc.py tables, so normalization and tokenization
+take all their usual paths. Embedding files are generated in OpenNMT
+format (one vector per language name, no header).
+
+Each benchmark is run at each size (--sizes lines for preprocessing,
+--vectors vectors for embeddings) and reports the best time of
+--repeat runs, throughput, and the peak memory allocated during one
+further (traced) run, giving a scaling curve per benchmark.
+
+With --save FILE, results are written to FILE as JSON. With --compare
+FILE, results are compared against such a baseline, and the exit status
+is 1 if any benchmark is slower than the baseline by more than
+--tolerance (default 0.25, ie 25%).
+
+Embedding benchmarks require numpy (and the wordvecutil dependencies).
+'''
+
+import sys
+import os
+import io
+import getopt
+import json
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import phonproc
+import langstore
+
+SIZES = [1000, 10000, 100000] # Lines per preprocessing run
+VECTOR_SIZES = [1000, 5000] # Vectors per embedding run
+DIM = 50 # Embedding dimensions
+REPEAT = 3 # Timed runs per benchmark and size; the best is kept
+TOLERANCE = 0.25 # Allowed slowdown against baseline
+SEED = 0
+
+NEAR_QUERIES = 100 # Words queried by the near benchmarks
+DUPLICATE_RATE = 0.2 # Share of generated transcriptions repeating an earlier one
+MODIFIER_RATE = 0.15 # Chance of a diacritic/modifier after each base symbol
+NOISE_RATE = 0.03 # Chance of a replaced/deleted symbol after each base symbol
+ELIMINATE_RATE = 0.005 # Share of transcriptions with an eliminated symbol
+SPACE_RATE = 0.05 # Share of transcriptions with two space-separated parts
+
+# Symbols drawn from the phonproc.py tables
+BASE = sorted(phonproc.ALLOW - phonproc.ATTACH - phonproc.ELIMINATE - set(phonproc.REPLACE))
+MODIFIERS = sorted(phonproc.ATTACH | phonproc.LENGTH | phonproc.PHONATION | phonproc.NASALIZATION)
+NOISE = sorted(set(phonproc.REPLACE) | phonproc.DELETE)
+ELIMINATED = sorted(phonproc.ELIMINATE)
+
+def language_names():
+	'''
+	Returns sorted list of language names in langs.store
+	'''
+	with langstore.Store("langs.store") as store:
+		return sorted(set(store.names.values()))
+
+def generate_transcription(rng):
+	symbols = []
+	for _ in range(rng.randint(2, 12)):
+		symbols.append(rng.choice(BASE))
+		if rng.random() < MODIFIER_RATE:
+			symbols.append(rng.choice(MODIFIERS))
+		if rng.random() < NOISE_RATE:
+			symbols.append(rng.choice(NOISE))
+	if rng.random() < ELIMINATE_RATE:
+		symbols.insert(rng.randrange(len(symbols)), rng.choice(ELIMINATED))
+	if rng.random() < SPACE_RATE:
+		symbols.insert(rng.randrange(1, len(symbols)), " ")
+	return "".join(symbols)
+
+def generate_lines(n, seed=SEED):
+	'''
+	Returns n synthetic lines formatted LANG⦀TRANSCRIPTION, with
+	Zipf-distributed language frequencies and some duplicates
+	'''
+	rng = random.Random(seed)
+	names = language_names()
+	weights = [1 / rank for rank in range(1, len(names) + 1)]
+	langs = rng.choices(names, weights, k=n)
+
+	lines = []
+	for lang in langs:
+		if lines and rng.random() < DUPLICATE_RATE:
+			lines.append(rng.choice(lines))
+		else:
+			lines.append(lang + phonproc.DELIMITER + generate_transcription(rng) + "\n")
+	return lines
+
+def generate_vectors(path, n, dim=None, seed=SEED):
+	'''
+	Writes n random vectors (of dim dimensions, default DIM), named
+	after languages, to path in OpenNMT embedding format
+	'''
+	dim = dim or DIM
+	rng = random.Random(seed)
+	names = [name.replace(" ", "") for name in language_names()]
+	with io.open(path, "w", encoding="utf-8") as f:
+		for i in range(n):
+			# Language names first, then numbered copies
+			word = names[i] if i < len(names) else names[i % len(names)] + str(i // len(names))
+			f.write(word + " " + " ".join("%.6f" % rng.gauss(0, 1) for _ in range(dim)) + "\n")
+
+# == Benchmarks ==
+# Each benchmark is a function of data returning the number of items
+# processed; its setup function of (size, workdir) builds the data
+# outside of the timing.
+
+def setup_lines(size, workdir):
+	return generate_lines(size)
+
+def setup_transcriptions(size, workdir):
+	lines = generate_lines(size)
+	return [line.split(phonproc.DELIMITER, 1) for line in lines]
+
+def setup_tokenize(size, workdir):
+	grouped = {}
+	for (tag, transcription) in setup_transcriptions(size, workdir):
+		grouped.setdefault(tag, []).extend(phonproc.normalize(transcription).split())
+	return grouped
+
+def setup_unique(size, workdir):
+	return list(phonproc.iter_processed(generate_lines(size)))
+
+def bench_normalize(data):
+	for (tag, transcription) in data:
+		phonproc.normalize(transcription)
+	return len(data)
+
+def bench_tokenize(data):
+	n = 0
+	for (tag, transcriptions) in data.items():
+		n += len(phonproc.tokenize_all(transcriptions, tag))
+	return n
+
+def bench_unique(data):
+	phonproc.unique(data)
+	return len(data)
+
+def bench_process_lines(data):
+	for _ in phonproc.process_lines(data):
+		pass
+	return len(data)
+
+def setup_vector_file(size, workdir):
+	path = os.path.join(workdir, "vectors." + str(size) + ".txt")
+	if not os.path.exists(path):
+		generate_vectors(path, size)
+	return path
+
+def setup_cold_load(size, workdir):
+	import wordvecutil
+	path = setup_vector_file(size, workdir)
+	return (path, wordvecutil.cache_paths(path))
+
+def setup_cached_load(size, workdir):
+	import wordvecutil
+	path = setup_vector_file(size, workdir)
+	wordvecutil.word_vectors(path, quiet=True) # Writes cache
+	return path
+
+def setup_word_vectors(size, workdir):
+	import wordvecutil
+	v = wordvecutil.word_vectors(setup_vector_file(size, workdir), quiet=True)
+	return (v, v.idx2word[:NEAR_QUERIES])
+
+def bench_load_cold(data):
+	import wordvecutil
+	(path, cache) = data
+	for cache_path in cache:
+		if os.path.exists(cache_path):
+			os.remove(cache_path)
+	return wordvecutil.word_vectors(path, quiet=True).numtypes
+
+def bench_load_cached(data):
+	import wordvecutil
+	return wordvecutil.word_vectors(data, quiet=True).numtypes
+
+def bench_near(data):
+	(v, words) = data
+	for word in words:
+		v.near(word)
+	return len(words)
+
+def bench_near_many(data):
+	(v, words) = data
+	v.near_many(words)
+	return len(words)
+
+def bench_similarity(data):
+	import numpy
+	import wordvecutil
+	(v, words) = data
+	sim = v.similarity_matrix()
+	rows = numpy.arange(len(v.idx2word)) % 2 == 0 # Stands in for a family mask
+	wordvecutil.block_mean(sim, rows, rows)
+	wordvecutil.block_mean(sim, rows, ~rows)
+	return len(v.idx2word) ** 2
+
+# name -> (setup, benchmark, uses vector sizes)
+BENCHMARKS = {
+	"normalize": (setup_transcriptions, bench_normalize, False),
+	"tokenize": (setup_tokenize, bench_tokenize, False),
+	"unique": (setup_unique, bench_unique, False),
+	"process_lines": (setup_lines, bench_process_lines, False),
+	"load_vectors_cold": (setup_cold_load, bench_load_cold, True),
+	"load_vectors_cached": (setup_cached_load, bench_load_cached, True),
+	"near": (setup_word_vectors, bench_near, True),
+	"near_many": (setup_word_vectors, bench_near_many, True),
+	"similarity": (setup_word_vectors, bench_similarity, True),
+}
+
+def run(name, size, workdir, repeat=REPEAT):
+	'''
+	Runs benchmark at size
+
+	Return:
+	* Dictionary of seconds (best of repeat), items,
+	items_per_second and peak_kb (allocated during a traced run)
+	'''
+	(setup, bench, _) = BENCHMARKS[name]
+	data = setup(size, workdir)
+
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		items = bench(data)
+		seconds = time.perf_counter() - start
+		best = seconds if best is None else min(best, seconds)
+
+	tracemalloc.start()
+	bench(data)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	return {
+		"seconds": round(best, 6),
+		"items": items,
+		"items_per_second": round(items / best, 1) if best > 0 else None,
+		"peak_kb": peak // 1024
+	}
+
+def compare(results, baseline, tolerance=TOLERANCE):
+	'''
+	Prints change in time of each benchmark and size found
+	in baseline
+
+	Return:
+	* List of (name, size, ratio) of regressions beyond tolerance
+	'''
+	regressions = []
+	for (name, sizes) in results.items():
+		for (size, result) in sizes.items():
+			base = baseline.get(name, {}).get(size)
+			if base is None or not base["seconds"]:
+				continue
+			ratio = result["seconds"] / base["seconds"]
+			flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+			print(name + "\t" + size + "\t" + str(base["seconds"]) + " -> " + str(result["seconds"]) + "\t" + "x" + str(round(ratio, 2)) + flag)
+			if flag:
+				regressions.append((name, size, ratio))
+	return regressions
+
+if __name__ == "__main__":
+	USAGE = "benchmark.py [--sizes N,N,...] [--vectors N,N,...] [--dim D] [--repeat R] [--only NAME,NAME,...] [--save FILE] [--compare FILE] [--tolerance T]"
+
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "", ["sizes=", "vectors=", "dim=", "repeat=", "only=", "save=", "compare=", "tolerance="])
+	except getopt.GetoptError:
+		print(USAGE)
+		sys.exit(1)
+	if args:
+		print(USAGE)
+		sys.exit()
+
+	ONLY = list(BENCHMARKS)
+	SAVE = None
+	COMPARE = None
+	for opt, arg in opts:
+		if opt == "--sizes":
+			SIZES = [int(size) for size in arg.split(",")]
+		elif opt == "--vectors":
+			VECTOR_SIZES = [int(size) for size in arg.split(",")]
+		elif opt == "--dim":
+			DIM = int(arg)
+		elif opt == "--repeat":
+			REPEAT = int(arg)
+		elif opt == "--only":
+			ONLY = arg.split(",")
+		elif opt == "--save":
+			SAVE = arg
+		elif opt == "--compare":
+			COMPARE = arg
+		elif opt == "--tolerance":
+			TOLERANCE = float(arg)
+
+	for name in ONLY:
+		if name not in BENCHMARKS:
+			print("Unknown benchmark:", name, "(" + ", ".join(BENCHMARKS) + ")")
+			sys.exit(1)
+
+	sys.stdout.reconfigure(encoding="utf-8")
+
+	results = {}
+	workdir = tempfile.mkdtemp(prefix="benchmark_")
+	try:
+		for name in ONLY:
+			results[name] = {}
+			for size in (VECTOR_SIZES if BENCHMARKS[name][2] else SIZES):
+				try:
+					result = run(name, size, workdir, REPEAT)
+				except ImportError as e: # numpy etc. missing for embedding benchmarks
+					print(name + "\tskipped:", e)
+					break
+				results[name][str(size)] = result
+				print(name + "\t" + str(size) + "\t" + str(result["seconds"]) + "s\t" +
+					str(result["items_per_second"]) + "/s\t" + str(result["peak_kb"]) + " KB")
+	finally:
+		shutil.rmtree(workdir)
+
+	if SAVE:
+		with open(SAVE, "w", encoding="utf-8") as f:
+			json.dump({"python": sys.version.split()[0], "dim": DIM, "results": results}, f, indent=2)
+			f.write("\n")
+
+	if COMPARE:
+		with open(COMPARE, "r", encoding="utf-8") as f:
+			baseline = json.load(f)["results"]
+		print()
+		regressions = compare(results, baseline, TOLERANCE)
+		if regressions:
+			print(len(regressions), "regression(s) beyond", str(round(TOLERANCE * 100)) + "%")
+			sys.exit(1)
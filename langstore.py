@@ -0,0 +1,231 @@
+# encoding: utf-8
+
+'''
+Compact, read-only store of language names and families,
+built by namesdict.py and memory-mapped on open
+
+Tables (read-only Mappings of str keys):
+	names - Wiktionary code -> language name
+	codes - Language name -> code (first, if shared by several codes)
+	members - Family -> frozenset of member languages
+	families - Language -> family
+
+Each table holds its (key, value) pairs sorted by UTF-8 key, so lookups
+are binary searches over the mapped file; nothing is parsed or
+unpickled on open, and processes sharing the file share its pages.
+Lookups are memoized per table, so a key looked up again (eg once per
+line) costs a dict lookup.
+
+	store = Store("langs.store")
+	store.names["aa"] # "Afar"
+	store.families["German"] # "Germanic"
+	store.names.get("xx", "xx") # "xx"
+
+File layout (little-endian):
+	MAGIC, uint32 table count, then per table a 16-byte name
+	and uint64 offset of:
+		uint32 pairs n, uint32 distinct keys,
+		uint32 key offsets[n + 1], uint32 value offsets[n + 1],
+		key bytes, value bytes
+'''
+
+import mmap
+import struct
+from collections.abc import Mapping
+
+MAGIC = b"LANGSTO1"
+NAME_SIZE = 16 # Bytes per table name in header
+
+# Tables with several values per key (returned as frozensets)
+MULTI_VALUED = {"members"}
+
+class Table(Mapping):
+	'''
+	Sorted table of (key, value) pairs in mapped store
+	'''
+
+	def __init__(self, buffer, offset, multi_valued=False):
+		self.buffer = buffer
+		self.multi_valued = multi_valued
+		(self.n, self.distinct) = struct.unpack_from("<II", buffer, offset)
+		self.key_offsets = offset + 8
+		self.value_offsets = self.key_offsets + 4 * (self.n + 1)
+		self.keys_start = self.value_offsets + 4 * (self.n + 1)
+		self.values_start = self.keys_start + struct.unpack_from("<I", buffer, self.key_offsets + 4 * self.n)[0]
+		self.memo = dict() # Key -> value (None if missing) of keys looked up so far
+
+	def key(self, i):
+		(start, end) = struct.unpack_from("<II", self.buffer, self.key_offsets + 4 * i)
+		return self.buffer[self.keys_start + start:self.keys_start + end]
+
+	def value(self, i):
+		(start, end) = struct.unpack_from("<II", self.buffer, self.value_offsets + 4 * i)
+		return self.buffer[self.values_start + start:self.values_start + end].decode("utf-8")
+
+	def find(self, key):
+		'''
+		Returns index of first pair with key, or None
+		'''
+		if not isinstance(key, str):
+			return None
+		key = key.encode("utf-8")
+		(lo, hi) = (0, self.n)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self.key(mid) < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo < self.n and self.key(lo) == key:
+			return lo
+		return None
+
+	def lookup(self, key):
+		'''
+		Returns value of key (frozenset if multi-valued), or None
+		if key is missing; memoized
+		'''
+		try:
+			return self.memo[key]
+		except KeyError:
+			pass
+		except TypeError: # Unhashable, so not a key
+			return None
+
+		i = self.find(key)
+		if i is None:
+			value = None
+		elif not self.multi_valued:
+			value = self.value(i)
+		else:
+			values = []
+			encoded = self.key(i)
+			while i < self.n and self.key(i) == encoded:
+				values.append(self.value(i))
+				i += 1
+			value = frozenset(values)
+
+		self.memo[key] = value
+		return value
+
+	def __getitem__(self, key):
+		value = self.lookup(key)
+		if value is None:
+			raise KeyError(key)
+		return value
+
+	def get(self, key, default=None):
+		value = self.lookup(key)
+		return default if value is None else value
+
+	def __contains__(self, key):
+		return self.lookup(key) is not None
+
+	def __iter__(self):
+		previous = None
+		for i in range(self.n):
+			key = self.key(i)
+			if key != previous:
+				yield key.decode("utf-8")
+				previous = key
+
+	def __len__(self):
+		return self.distinct
+
+class Store:
+	'''
+	Memory-mapped language store
+
+	Attributes:
+	* names, codes, members, families - Tables (see module description)
+	'''
+
+	def __init__(self, path):
+		with open(path, "rb") as f:
+			self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		if self.buffer[:len(MAGIC)] != MAGIC:
+			self.buffer.close()
+			raise ValueError(path + " is not a language store")
+
+		(count,) = struct.unpack_from("<I", self.buffer, len(MAGIC))
+		position = len(MAGIC) + 4
+		self.tables = dict()
+		for _ in range(count):
+			name = self.buffer[position:position + NAME_SIZE].rstrip(b"\0").decode("ascii")
+			(offset,) = struct.unpack_from("<Q", self.buffer, position + NAME_SIZE)
+			self.tables[name] = Table(self.buffer, offset, name in MULTI_VALUED)
+			position += NAME_SIZE + 8
+
+		self.names = self.tables["names"]
+		self.codes = self.tables["codes"]
+		self.members = self.tables["members"]
+		self.families = self.tables["families"]
+
+	def close(self):
+		self.tables = dict()
+		self.names = self.codes = self.members = self.families = None
+		self.buffer.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def pack_table(pairs):
+	'''
+	Returns bytes of table of (key, value) string pairs
+	'''
+	pairs = sorted((key.encode("utf-8"), value.encode("utf-8")) for (key, value) in pairs)
+
+	key_offsets = [0]
+	value_offsets = [0]
+	for (key, value) in pairs:
+		key_offsets.append(key_offsets[-1] + len(key))
+		value_offsets.append(value_offsets[-1] + len(value))
+
+	return b"".join([
+		struct.pack("<II", len(pairs), len({key for (key, value) in pairs})),
+		struct.pack("<" + str(len(key_offsets)) + "I", *key_offsets),
+		struct.pack("<" + str(len(value_offsets)) + "I", *value_offsets),
+		b"".join(key for (key, value) in pairs),
+		b"".join(value for (key, value) in pairs)
+	])
+
+def write_store(path, names, members):
+	'''
+	Writes language store
+
+	Arguments:
+	* names - Dict of code -> language name
+	* members - Dict of family -> iterable of member languages
+	'''
+	# First code of each name, first family of each language (one-valued tables)
+	codes = dict()
+	for (code, name) in sorted(names.items()):
+		codes.setdefault(name, code)
+	families = dict()
+	for (family, languages) in sorted(members.items()):
+		for language in languages:
+			families.setdefault(language, family)
+
+	tables = [
+		("names", pack_table(names.items())),
+		("codes", pack_table(codes.items())),
+		("members", pack_table((family, language) for (family, languages) in members.items() for language in languages)),
+		("families", pack_table(families.items()))
+	]
+
+	header_size = len(MAGIC) + 4 + len(tables) * (NAME_SIZE + 8)
+	header = [MAGIC, struct.pack("<I", len(tables))]
+	offset = header_size
+	for (name, data) in tables:
+		header.append(name.encode("ascii").ljust(NAME_SIZE, b"\0"))
+		header.append(struct.pack("<Q", offset))
+		offset += len(data)
+
+	with open(path, "wb") as f:
+		f.write(b"".join(header))
+		for (name, data) in tables:
+			f.write(data)
@@ -1,18 +1,34 @@
 '''
-namesdict.py names_file output
-Builds dictionary linking Wiktionary tags with
-language names based on file with correspondence
+namesdict.py names_file [families_file] output
+Builds language store (see langstore.py) linking Wiktionary
+tags with language names based on file with correspondence
 on each line in format:
 	["TAG"] = "NAME"
+and, optionally, language families from file with one
+family member on each line in format:
+	FAMILY	LANGUAGE
 '''
-import pickle
 import sys
 
-f = open(sys.argv[1], "r")
-d = dict()
-for line in f:
-	parse = line.split('"')
-	if len(parse) == 5:
-		d[parse[1]] = parse[3]
-	
-pickle.dump(d, open(sys.argv[2], "wb"))
+import langstore
+
+if __name__ == "__main__":
+	if len(sys.argv) not in (3, 4):
+		print("namesdict.py names_file [families_file] output")
+		sys.exit()
+
+	f = open(sys.argv[1], "r", encoding="utf-8")
+	d = dict()
+	for line in f:
+		parse = line.split('"')
+		if len(parse) == 5:
+			d[parse[1]] = parse[3]
+
+	families = dict()
+	if len(sys.argv) == 4:
+		for line in open(sys.argv[2], "r", encoding="utf-8"):
+			parse = line.rstrip("\r\n").split("\t")
+			if len(parse) == 2:
+				families.setdefault(parse[0], set()).add(parse[1])
+
+	langstore.write_store(sys.argv[-1], d, families)
@@ -0,0 +1,195 @@
+# encoding: utf-8
+
+'''
+Compact binary format for corpora written by process.py
+
+A corpus saved under PREFIX consists of:
+	PREFIX.symbols.txt - Symbol vocabulary, one symbol per line (id = line number)
+	PREFIX.langs.txt - Language vocabulary, one tag per line (id = line number)
+	PREFIX.tokens.npy - uint16 symbol ids of all sequences, concatenated
+	PREFIX.offsets.npy - uint64 offsets; sequence i is tokens[offsets[i]:offsets[i + 1]]
+	PREFIX.lang_ids.npy - uint16 language id of each sequence
+
+The .npy files are memory-mapped when read, so sequences are
+returned as views without copying or parsing.
+
+	corpus = BinaryCorpus("phon6/corpus")
+	for (ids, lang_id) in corpus:
+		...
+
+phoncorpus.py PREFIX corpus.txt converts process.py text output to this
+format and checks that reading it back gives the same corpus.
+'''
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+from array import array
+
+import numpy
+
+MAX_ID = 0xFFFF # Largest id storable as uint16
+ITER_BLOCK = 1 << 16 # Sequences per block when iterating
+FLUSH_SIZE = 1 << 20 # Ids buffered per array before spilling to disk
+COPY_SIZE = 1 << 20 # Bytes copied at a time when writing .npy files
+
+def read_vocab(path):
+	'''
+	Returns list of entries in vocabulary file
+	'''
+	with io.open(path, "r", encoding="utf-8", newline="\n") as f:
+		return [line[:-1] for line in f]
+
+def write_vocab(path, entries):
+	'''
+	Writes vocabulary entries to file, one per line
+	'''
+	with io.open(path, "w", encoding="utf-8", newline="\n") as f:
+		for entry in entries:
+			f.write(entry + "\n")
+
+class CorpusWriter:
+	'''
+	Builds binary corpus one sequence at a time
+
+	Ids are buffered FLUSH_SIZE at a time and spilled to raw temporary
+	files, so memory use does not grow with the corpus; close() writes
+	the .npy headers and copies the spills behind them.
+
+	Methods:
+	* add(tokens, tag) - Appends sequence of symbols with language tag
+	* close() - Writes corpus files
+	'''
+
+	def __init__(self, prefix):
+		self.prefix = prefix
+		self.symbols = dict() # Symbol -> id
+		self.langs = dict() # Tag -> id
+		self.size = 0 # Tokens written so far
+
+		# Buffers and their spill files
+		self.tokens = array("H")
+		self.offsets = array("Q", [0])
+		self.lang_ids = array("H")
+		self.spills = {name: tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(prefix))) for name in ("tokens", "offsets", "lang_ids")}
+		self.counts = {"tokens": 0, "offsets": 0, "lang_ids": 0} # Entries spilled
+
+	def get_id(self, vocab, entry):
+		i = vocab.get(entry)
+		if i is None:
+			i = len(vocab)
+			if i > MAX_ID:
+				raise ValueError("Vocabulary exceeds " + str(MAX_ID + 1) + " entries")
+			vocab[entry] = i
+		return i
+
+	def add(self, tokens, tag):
+		symbols = self.symbols
+		before = len(self.tokens)
+		self.tokens.extend(symbols[token] if token in symbols else self.get_id(symbols, token) for token in tokens)
+		self.size += len(self.tokens) - before
+		self.offsets.append(self.size)
+		self.lang_ids.append(self.get_id(self.langs, tag))
+		if len(self.tokens) >= FLUSH_SIZE or len(self.offsets) >= FLUSH_SIZE:
+			self.flush()
+
+	def flush(self):
+		'''
+		Spills buffered ids to temporary files
+		'''
+		for (name, buffer) in (("tokens", self.tokens), ("offsets", self.offsets), ("lang_ids", self.lang_ids)):
+			buffer.tofile(self.spills[name])
+			self.counts[name] += len(buffer)
+			del buffer[:]
+
+	def close(self):
+		self.flush()
+		write_vocab(self.prefix + ".symbols.txt", self.symbols.keys())
+		write_vocab(self.prefix + ".langs.txt", self.langs.keys())
+		for (name, dtype) in (("tokens", numpy.uint16), ("offsets", numpy.uint64), ("lang_ids", numpy.uint16)):
+			spill = self.spills[name]
+			spill.seek(0)
+			with open(self.prefix + "." + name + ".npy", "wb") as f:
+				numpy.lib.format.write_array_header_1_0(f, {
+					"descr": numpy.lib.format.dtype_to_descr(numpy.dtype(dtype)),
+					"fortran_order": False,
+					"shape": (self.counts[name],)
+				})
+				shutil.copyfileobj(spill, f, COPY_SIZE)
+			spill.close()
+
+class BinaryCorpus:
+	'''
+	Memory-mapped reader for corpus written by CorpusWriter
+
+	Methods:
+	* corpus[i] - Pair (uint16 array of symbol ids, language id) of sequence i
+	* iter(corpus) - Iterates over (ids, language id) pairs
+	* decode(i) - Pair (list of symbols, language tag) of sequence i
+	* lines() - Iterates over sequences in process.py text format
+
+	Attributes:
+	* symbols - List of symbols (index = id)
+	* langs - List of language tags (index = id)
+	* tokens, offsets, lang_ids - Memory-mapped arrays
+	'''
+
+	def __init__(self, prefix):
+		self.symbols = read_vocab(prefix + ".symbols.txt")
+		self.langs = read_vocab(prefix + ".langs.txt")
+		self.tokens = numpy.load(prefix + ".tokens.npy", mmap_mode="r")
+		self.offsets = numpy.load(prefix + ".offsets.npy", mmap_mode="r")
+		self.lang_ids = numpy.load(prefix + ".lang_ids.npy", mmap_mode="r")
+
+	def __len__(self):
+		return len(self.lang_ids)
+
+	def __getitem__(self, i):
+		return (self.tokens[self.offsets[i]:self.offsets[i + 1]], self.lang_ids[i])
+
+	def __iter__(self):
+		tokens = self.tokens
+		for start in range(0, len(self), ITER_BLOCK):
+			# Offsets converted a block at a time - Python ints slice faster than numpy scalars
+			offsets = self.offsets[start:start + ITER_BLOCK + 1].tolist()
+			lang_ids = self.lang_ids[start:start + ITER_BLOCK].tolist()
+			for (i, lang_id) in enumerate(lang_ids):
+				yield (tokens[offsets[i]:offsets[i + 1]], lang_id)
+
+	def decode(self, i):
+		(ids, lang_id) = self[i]
+		return ([self.symbols[j] for j in ids.tolist()], self.langs[lang_id])
+
+	def lines(self):
+		'''
+		Yields sequences as lines of OpenNMT input, as
+		written by process.py
+		'''
+		for (ids, lang_id) in self:
+			tag = "￨" + self.langs[lang_id].replace(" ", "")
+			yield " ".join(self.symbols[j] + tag for j in ids.tolist()) + "\n"
+
+if __name__ == "__main__":
+	# Round-trip check: phoncorpus.py PREFIX corpus.txt
+	# rewrites corpus.txt (process.py output) in binary format under
+	# PREFIX, reads it back and compares it with corpus.txt
+	if len(sys.argv) != 3:
+		print("phoncorpus.py PREFIX corpus.txt")
+		sys.exit()
+
+	writer = CorpusWriter(sys.argv[1])
+	with io.open(sys.argv[2], "r", encoding="utf-8", newline="\n") as f:
+		for line in f:
+			tokens = [token.rpartition("￨") for token in line.split()]
+			writer.add([symbol for (symbol, _, tag) in tokens], tokens[0][2] if tokens else "")
+	writer.close()
+
+	corpus = BinaryCorpus(sys.argv[1])
+	with io.open(sys.argv[2], "r", encoding="utf-8", newline="\n") as f:
+		for (i, (line, expected)) in enumerate(zip(corpus.lines(), f)):
+			if line.split() != expected.split():
+				print("Mismatch at line", i + 1)
+				sys.exit(1)
+	print(len(corpus), "sequences,", corpus.offsets[-1], "tokens: OK")
@@ -0,0 +1,934 @@
+# encoding: utf-8
+
+'''
+Library for normalizing, tokenizing, and tagging phonetic
+transcriptions for OpenNMT (see process.py for the command line)
+
+Transcriptions are read as lines formatted:
+	TAG⦀TRANSCRIPTION
+and written one per line as space-separated tokens, each
+followed by "￨" and the (space-free) tag.
+
+The symbol groups below are the defaults. A Config object
+compiles them, along with MIN_LENGTH and LANG_MIN, into the
+tables used by the functions in this module; every function
+takes an optional config and falls back to DEFAULT_CONFIG.
+
+	config = Config(lang_min=100)
+	for (tokens, tag) in process_lines(lines, config):
+		...
+'''
+
+LANG_MIN = 0 # Minimum number of unique transcriptions for a language to be written
+MIN_LENGTH = 2
+BAD_LANGUAGE = {"proto", "esperanto", "ido", "lojban", "interlingua", "volap", "toki", "translingual"} # excludes constructed, reconstructed
+#BAD_LANGUAGE = {"old", "middle", "classical", "gothic", "proto", "esperanto", "ido", "lojban", "interlingua", "volap", "toki", "translingual"} # excludes constructed, reconstructed, extinct prior to documentation
+
+# == Symbol Groups by Type ==
+UNKNOWN_PHONEME = {
+}
+	
+PHONATION = {
+	"ʰ", # aspiration
+	"ʱ", # breathy voice
+	"̚" # unreleased stop
+}
+
+SECONDARY_ARTICULATION = {
+	"ʷ", # labalized
+	"ʲ", # palatalized
+	"ˠ", # velarized
+	"ˁ" # pharyngealized
+}
+	
+NASALIZATION = {"̃"} # ã
+	
+LENGTH = {
+	"̆", # ă Extra-short
+	"ː", # long
+	"ˑ" # half-long
+}
+	
+VOWEL_OTHER = {
+	
+	"̜", # ̜a Less rounded
+	"̹", # ̹a More rounded (13)
+	"ᵝ" # rounded
+}
+	
+SYLLABICITY = {
+	"̍", # Syllabic
+	"̯" # Non-syllabic
+}
+			
+RELATIVE_ARTICULATION = {
+	"̝", "̞", # Raised, lowered
+	"̟", "̠", # Advancced, retracted
+	"̤",  # ̈Centralized
+	"̽" # Mid-centralized (3) DELETED
+}
+	
+SYLLABIC = {"̩"} # ̩r
+	
+OTHER = {
+	"̢" # Hook
+}
+	
+LAMINAL = { # 63
+	"̻" 
+}
+
+# == Tokenization/Normalization Action Symbol Groups ==
+ATTACH = { # Append to previous token
+	"̥", # ̥x voiceless
+	"̧", # ̧c cedille
+	"̪", # ̪t dental
+	"ʼ" # ejective DELETED
+} | SECONDARY_ARTICULATION
+
+REPLACE = { # Key must be single character
+	"!": "ǃ", # click
+	":": "ː", # vowel length
+	"ʇ": "ǀ", "ʖ": "ǁ", "ʗ": "ǃ",
+	"̊": "̥", # Voicelessness
+	"̈": "̤", # Centralization
+	"̺": "̪", # Dental
+	"‿": "͡", # Affricate
+	"͜": "͡", # Affricate - sometimes reps dipthong - eliminate symbol entirely?
+	"g": "ɡ",
+	"ʴ": "˞", # rhotic
+	"ˀ": "ʔ", # glottal stop
+	"ᶑ": "ɗ", # voiced retroflex implosive (contested?) -> voiced alveolar implosive
+	"˔": "̝", # raised
+	# rhotic vowels ???????
+	"ɚ": "əɹ",
+	"ɝ": "əɹ", # ??
+	# NOTE : Fix below if decide to include affricate tie
+	"ʦ": "ts",
+	"ʣ": "dz",
+	"ʧ": "tʃ",
+	"ʤ": "dʒ",
+	"ʨ": "tɕ",
+	"ʥ": "dʐ",
+	"ɮ": "lʒ",
+	"ƛ": "tɬ",
+	"¢": "ts"
+}
+
+ELIMINATE = { # Eliminate entire transcription
+	"_", "ƙ",
+	"ƞ", "ȵ", # Alveo palatal (nasals) ?
+	"ȶ",
+	"ƶ",
+	"̬", # ̬p voiced (used only 3 times in wiktionary data)
+	"-" # prefix/suffix in wiktionary data
+}
+
+DELETE = { # Delete symbol
+	"'", "ˈ", "ˌ", # Stress
+	"°", 
+	"*", "^", "·", "ı",
+	".", # Syllable
+	"1", "2", "3", "4", "5", "6", "7", "8", "9", # Tone
+	"¹", "²", "³", "⁴", "⁵", "⁶", "⁸", 
+	"˥", "˦", "˧", "˨", "˩",
+	"ˢ", "ˣ", "ˡ", 
+	"̂", "̄", "̋", "̌", "̏", "ˇ",    # â ā ̋a ̌a ̏a
+	"↓", "↗", "↘", "ꜜ",
+	"᷄", "᷅", "᷆", "᷇", "᷈", # Tone contour
+	"́", "́", "̀", # á ́a à Stress
+	"̘", "̙", # ̘a ̙a ATR, RTR
+	"̣", # Dot
+	"ᵇ", "ᵈ", "ᵊ", "ᵐ", "ᵑ",
+	"ᶢ", # voiced retroflex click ?
+	"ⁿ", # Nasal release (28)
+	"͡", # Affrication tie - Chose to eliminate b/c of prevelance of unmarked affricates
+	"̰", # unknown
+	"͈", # Fortis
+	"͍", # Labial spreading ???
+	"ʳ", # r-coloring
+	"̬", # voicing ?????
+	"◌", # ????
+	"˞",
+	"̽", # Mid-centralized (3)
+	"̪̥",
+	"ʼ",
+	"∅", "⁻", "⁓", "ᶣ", "˭", "ˤ", "͇"
+} | PHONATION | NASALIZATION | LENGTH | VOWEL_OTHER | SYLLABICITY | RELATIVE_ARTICULATION | SYLLABIC | OTHER | LAMINAL | SECONDARY_ARTICULATION
+
+DELETE_ALL_AFTER = { # Delete symbol and all following
+	",", "~" # May be better to split into two transcriptions
+}
+
+ALLOW = { # Not in use
+	"a", "b", "c", "d", "e", "f", "h", "i", "j", "k", "l", "m", "n", "o", "p", "q", "r", "s", "t", "u", "v", "w", "x", "y", "z", "æ", "ð", "ø", "ħ", "ŋ", "œ", "ƙ", "ƛ", "ƞ", "ƶ", "ǀ", "ǁ", "ǂ", "ǃ", "ȵ", "ȶ", "ɐ", "ɑ", "ɒ", "ɓ", "ɔ", "ɕ", "ɖ", "ɗ", "ɘ", "ə", "ɚ", "ɛ", "ɜ", "ɝ", "ɞ", "ɟ", "ɠ", "ɡ", "ɢ", "ɣ", "ɤ", "ɥ", "ɦ", "ɧ", "ɨ", "ɩ", "ɪ", "ɫ", "ɬ", "ɭ", "ɮ", "ɯ", "ɰ", "ɱ", "ɲ", "ɳ", "ɴ", "ɵ", "ɶ", "ɷ", "ɸ", "ɹ", "ɺ", "ɻ", "ɽ", "ɾ", "ɿ", "ʀ", "ʁ", "ʂ", "ʃ", "ʄ", "ʇ", "ʈ", "ʉ", "ʊ", "ʋ", "ʌ", "ʍ", "ʎ", "ʏ", "ʐ", "ʑ", "ʒ", "ʔ", "ʕ", "ʖ", "ʗ", "ʘ", "ʙ", "ʜ", "ʝ", "ʟ", "ʡ", "ʢ", "ʣ", "ʤ", "ʦ", "ʧ", "ʯ", "β", "θ", "λ", "χ", "а", "ч", "ҫ", "ӕ"
+} | ATTACH
+
+CAN_VOICELESS = {"l", "m", "n", "r", "w", "ɲ", "ɹ", "ɽ", "ɾ", "ʋ"}
+	
+	
+	
+# FIX: ɝ/ɚ separation; ɮ; r-coloring; look at Americanist transcriptions; distinctive features?
+	
+
+import collections
+import unicodedata
+import re
+import tempfile
+import multiprocessing
+import hashlib
+import time
+import json
+from array import array
+
+try:
+	import resource
+except ImportError: # Not available on Windows
+	resource = None
+
+DELIMITER = "⦀" # Separates language name from transcription
+FEATURE_DELIMITER = "￨" # Separates token from tag (OpenNMT feature)
+
+CHUNK_SIZE = 10000 # Lines per worker task when jobs > 1
+
+# Characters for which str.isspace() is True (listed rather than found by
+# scanning all code points, which took ~120 ms per import)
+WHITESPACE = list("\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005"
+	"\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000")
+
+# Tokenizer actions (see Config.compile())
+(APPEND, SKIP, OPEN, CLOSE, QUOTE, SPACE, STOP, BAR, ATTACH_TO_PREV, ATTACH_VOICELESS) = range(10)
+VOICELESS = "̥"
+
+class Config:
+	'''
+	Settings and symbol tables for processing transcriptions,
+	compiled into lookup tables when constructed. Any setting not
+	passed uses the module-level default of the same (upper case) name.
+	
+	Attributes:
+	* min_length - Minimum number of tokens in a transcription
+	* lang_min - Minimum number of transcriptions for a language
+	* bad_language - Phrases excluding a language name (case insensitive)
+	* replace - Dict of single character replacements
+	* eliminate - Symbols that eliminate entire transcription
+	* delete - Symbols deleted during tokenization
+	* delete_all_after - Symbols truncating transcription
+	* attach - Symbols appended to previous token
+	* can_voiceless - Symbols the voiceless marker can attach to
+	'''
+	
+	def __init__(self, min_length=None, lang_min=None, bad_language=None, replace=None, eliminate=None,
+			delete=None, delete_all_after=None, attach=None, can_voiceless=None):
+		self.min_length = MIN_LENGTH if min_length is None else min_length
+		self.lang_min = LANG_MIN if lang_min is None else lang_min
+		self.bad_language = set(BAD_LANGUAGE if bad_language is None else bad_language)
+		self.replace = dict(REPLACE if replace is None else replace)
+		self.eliminate = set(ELIMINATE if eliminate is None else eliminate)
+		self.delete = set(DELETE if delete is None else delete)
+		self.delete_all_after = set(DELETE_ALL_AFTER if delete_all_after is None else delete_all_after)
+		self.attach = set(ATTACH if attach is None else attach)
+		self.can_voiceless = set(CAN_VOICELESS if can_voiceless is None else can_voiceless)
+		
+		self.compile()
+	
+	def compile(self):
+		'''
+		Builds lookup tables from symbol tables; must be called
+		again if symbol tables are modified after construction
+		'''
+		
+		# Normalization: a single translate pass plus a single regex scan per transcription
+		self.normalize_table = str.maketrans({c: " " for c in WHITESPACE}) # Normalize spaces
+		self.normalize_table.update(str.maketrans(self.replace)) # Replace characters
+		
+		self.eliminate_pattern = self.pattern(self.eliminate)
+		self.scan_pattern = self.pattern(self.eliminate | self.delete_all_after) # Any symbol needing eliminate/truncate
+		self.delete_all_after_order = list(self.delete_all_after)
+		
+		self.bad_language_pattern = self.pattern({substring.lower() for substring in self.bad_language})
+		self.bad_language_cache = dict() # Language name -> excluded
+		
+		# Tokenization: action for each character; characters not in the table
+		# start a new token. Later assignments take precedence, matching the
+		# order in which symbols were originally checked.
+		self.tokenize_actions = dict()
+		self.tokenize_actions.update({c: ATTACH_TO_PREV for c in self.attach})
+		if VOICELESS in self.attach:
+			self.tokenize_actions[VOICELESS] = ATTACH_VOICELESS
+		self.tokenize_actions.update({"|": BAR, "[": SKIP, "]": SKIP, "/": STOP})
+		self.tokenize_actions.update({c: SPACE for c in WHITESPACE})
+		self.tokenize_actions.update({c: SKIP for c in self.delete})
+		self.tokenize_actions.update({"(": OPEN, ")": CLOSE, '"': QUOTE})
+	
+	@staticmethod
+	def pattern(symbols):
+		'''
+		Compiles regex matching any of symbols (never matches if empty)
+		'''
+		if not symbols:
+			return re.compile("(?!)")
+		return re.compile("|".join(re.escape(symbol) for symbol in symbols))
+
+DEFAULT_CONFIG = Config()
+
+class Metrics:
+	'''
+	Timings and drop counts collected while processing
+	
+	Stage times are exclusive: iterators wrapped with timed()
+	form a chain (in STAGES order), and each stage is charged the
+	time spent producing its items minus the time spent in the
+	stage before it. Stages run in worker processes (jobs > 1) are summed over
+	all workers; "wait" is time the main process spent waiting on
+	workers, and "chunk_dedup" is the workers' deduplication within
+	each chunk, ahead of the main process's "dedup".
+	
+	Drops are counted per input line for bad_language, eliminate
+	and empty (transcription empty after normalization), and per
+	transcription for too_short, duplicate and below_lang_min.
+	
+	Attributes:
+	* times - Counter of seconds spent in each stage
+	* items - Counter of items produced by each stage
+	* drops - Counter of dropped entries per reason
+	'''
+	
+	def __init__(self):
+		self.times = collections.Counter()
+		self.items = collections.Counter()
+		self.drops = collections.Counter()
+		self.start = time.perf_counter()
+		
+		# Internal attributes
+		self.chain = [] # Names of timed() stages in pipeline order
+		self.cumulative = collections.Counter() # Time spent producing items, including earlier stages
+	
+	STAGES = ("read", "normalize", "tokenize", "wait", "dedup") # Order of timed() stages in pipeline
+	
+	def timed(self, iterable, stage):
+		'''
+		Returns iterator over iterable, charging the time spent
+		producing each item to stage (see class description)
+		'''
+		self.chain.append(stage)
+		return self.iter_timed(iter(iterable), stage)
+	
+	def iter_timed(self, it, stage):
+		clock = time.perf_counter
+		
+		while True:
+			start = clock()
+			try:
+				item = next(it)
+			except StopIteration:
+				self.cumulative[stage] += clock() - start
+				return
+			self.cumulative[stage] += clock() - start
+			self.items[stage] += 1
+			yield item
+	
+	def close_chain(self):
+		'''
+		Converts cumulative times of timed() stages into exclusive
+		times; call once the wrapped iterators are exhausted
+		'''
+		previous = 0.0
+		for stage in sorted(self.chain, key=self.STAGES.index):
+			self.times[stage] += self.cumulative[stage] - previous
+			previous = self.cumulative[stage]
+		self.chain = []
+		self.cumulative = collections.Counter()
+	
+	def merge(self, other):
+		'''
+		Adds times, items and drops from other Metrics object
+		'''
+		self.times.update(other.times)
+		self.items.update(other.items)
+		self.drops.update(other.drops)
+	
+	def report(self):
+		'''
+		Returns metrics as dictionary suitable for JSON
+		'''
+		stages = {}
+		for (stage, seconds) in self.times.items():
+			stages[stage] = {
+				"seconds": round(seconds, 6),
+				"items": self.items[stage],
+				"items_per_second": round(self.items[stage] / seconds, 1) if seconds > 0 else None
+			}
+		
+		report = {
+			"wall_seconds": round(time.perf_counter() - self.start, 6),
+			"stages": stages,
+			"drops": dict(self.drops)
+		}
+		if resource is not None:
+			# ru_maxrss is in kilobytes on Linux
+			report["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			report["peak_rss_children_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+		return report
+	
+	def write(self, path):
+		'''
+		Writes report() to JSON file
+		'''
+		with open(path, "w", encoding="utf-8") as f:
+			json.dump(self.report(), f, indent=2, ensure_ascii=False)
+			f.write("\n")
+
+class SeenSet:
+	'''
+	Set of (word, tag) pairs seen while deduplicating, stored as
+	64-bit fingerprints in an open-addressing (linear probing) table
+	backed by an array rather than as Python objects
+	
+	Methods:
+	* add(word, tag) - Adds pair, returns True if it was not present
+	
+	Attributes:
+	* exact - If True (default), pairs are also stored (as UTF-8 in one
+	buffer) and compared on fingerprint match, so collisions are
+	resolved. If False, only fingerprints are kept, and a collision
+	(about n² / 2^65 for n entries) silently drops a distinct pair
+	'''
+	
+	INITIAL_SIZE = 1 << 16 # Must be power of 2
+	
+	def __init__(self, exact=True):
+		self.exact = exact
+		self.size = 0
+		self.mask = self.INITIAL_SIZE - 1
+		self.limit = self.INITIAL_SIZE * 2 // 3 # Keeps load factor <= 2/3
+		self.slots = array("Q", bytes(8 * self.INITIAL_SIZE)) # 0 = empty slot
+		
+		if exact:
+			self.refs = array("I", bytes(4 * self.INITIAL_SIZE)) # Index of slot's key
+			self.keys = bytearray() # Concatenated keys
+			self.offsets = array("Q", [0]) # Key i = keys[offsets[i]:offsets[i + 1]]
+	
+	def __len__(self):
+		return self.size
+	
+	def add(self, word, tag):
+		key = word + DELIMITER + tag
+		if self.exact:
+			# Collisions are resolved, so the (per-process) built-in hash will do
+			fingerprint = (hash(key) & 0xFFFFFFFFFFFFFFFF) or 1
+			key = key.encode("utf-8")
+		else:
+			fingerprint = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+		
+		slots = self.slots
+		mask = self.mask
+		i = fingerprint & mask
+		
+		slot = slots[i]
+		while slot:
+			if slot == fingerprint:
+				if not self.exact:
+					return False
+				ref = self.refs[i]
+				offsets = self.offsets
+				if self.keys[offsets[ref]:offsets[ref + 1]] == key:
+					return False
+			i = (i + 1) & mask
+			slot = slots[i]
+		
+		slots[i] = fingerprint
+		if self.exact:
+			self.refs[i] = self.size
+			self.keys += key
+			self.offsets.append(len(self.keys))
+		self.size += 1
+		
+		if self.size > self.limit:
+			self.grow()
+		return True
+	
+	def grow(self):
+		'''
+		Doubles table size, reinserting fingerprints
+		'''
+		old_slots = self.slots
+		old_refs = self.refs if self.exact else None
+		
+		mask = self.mask = 2 * len(old_slots) - 1
+		self.limit = len(old_slots) * 4 // 3
+		slots = self.slots = array("Q", bytes(16 * len(old_slots)))
+		if self.exact:
+			refs = self.refs = array("I", bytes(8 * len(old_slots)))
+		
+		for (j, fingerprint) in enumerate(old_slots):
+			if fingerprint == 0:
+				continue
+			i = fingerprint & mask
+			while slots[i]:
+				i = (i + 1) & mask
+			slots[i] = fingerprint
+			if old_refs is not None:
+				refs[i] = old_refs[j]
+
+def unique(l, exact=True, metrics=None):
+	'''
+	Removes duplicates from list of tokens/tags
+	
+	Arguments:
+	* l: list of (list, string) doubles
+	* exact: compare entries on fingerprint match (see SeenSet)
+	* metrics: optional Metrics counting duplicates dropped
+	
+	Return:
+	* List without duplicates
+	'''
+	return list(iter_unique(l, exact, metrics))
+
+def iter_unique(l, exact=True, metrics=None):
+	'''
+	Yields first occurrence of each (tokens, tag) pair
+	in iterable l (see unique())
+	'''
+	seen = SeenSet(exact)
+	
+	for (tokens, tag) in l:
+		if seen.add("".join(tokens), tag):
+			yield (tokens, tag)
+		elif metrics is not None:
+			metrics.drops["duplicate"] += 1
+
+def normalize(x, config=None):
+	'''
+	Normalizes transcription: decomposes characters, normalizes
+	spaces, applies REPLACE, eliminates transcriptions containing
+	ELIMINATE symbols and truncates at DELETE_ALL_AFTER symbols
+	'''
+	config = config or DEFAULT_CONFIG
+	
+	# Normalization options: NFD = decompose, NFC = decompose + combine
+	# Do not use NFKD/NFKC - results in information loss (eg aspiration -> standard h)
+	string = unicodedata.normalize("NFD", x)
+	
+	string = string.translate(config.normalize_table) # Normalize spaces, replace characters
+	#string = "".join(c for c in string if c not in DELETE) # Delete characters in DELETE # MOVED TO TOKENIZE
+	
+	if config.scan_pattern.search(string) is None:
+		return string
+	
+	if config.eliminate_pattern.search(string):
+		return ""
+	
+	# NOTE: cuts at the symbol's position in DELETE_ALL_AFTER rather than in the string
+	for i, c in enumerate(config.delete_all_after_order):
+		if c in string:
+			return string[:i]
+	
+	return string
+
+def count_tokens(tokens, counter):
+	'''
+	Increments counter for tokens in list
+	Arguments:
+	* tokens - list of tokens
+	* counter - systems.Counter() object
+	'''
+	
+	for token in tokens:
+		counter[token] += 1
+
+def is_bad_language(lang, config=None):
+	'''
+	Returns True if language name contains phrase in
+	BAD_LANGUAGE (case insensitive); cached per name
+	'''
+	config = config or DEFAULT_CONFIG
+	
+	bad = config.bad_language_cache.get(lang)
+	if bad is None:
+		bad = config.bad_language_pattern.search(lang.lower()) is not None
+		config.bad_language_cache[lang] = bad
+	return bad
+
+def is_eliminated(x, config=None):
+	'''
+	Returns True if normalize() removes transcription because
+	it contains a symbol in ELIMINATE
+	'''
+	config = config or DEFAULT_CONFIG
+	string = unicodedata.normalize("NFD", x).translate(config.normalize_table)
+	return config.eliminate_pattern.search(string) is not None
+
+def read_transcriptions(f, excluded=None, config=None, metrics=None):
+	'''
+	Reads tagged transcriptions from text file formatted:
+		tag⦀transcription
+	Removes languages containing phrases in BAD_LANAGUAGES
+	set, empty transcriptions.
+	
+	Arguments:
+	* f - File (or other iterable of lines) to read
+	* excluded - Optional collections.Counter() incremented for
+	each line removed because of its language
+	* metrics - Optional Metrics counting lines dropped
+	
+	Return:
+	* List of pairs (language, transcription)
+	'''
+	return list(iter_transcriptions(f, excluded, config, metrics))
+
+def iter_transcriptions(f, excluded=None, config=None, metrics=None):
+	'''
+	Yields (language, transcription) pairs from file
+	one line at a time (see read_transcriptions())
+	'''
+	config = config or DEFAULT_CONFIG
+	
+	for line in f:
+		
+		# Split line by delimiter
+		parse = line.split(DELIMITER)
+		
+		# Get language, check if excluded
+		lang = parse[0]
+		if is_bad_language(lang, config):
+			if excluded is not None:
+				excluded[lang] += 1
+			if metrics is not None:
+				metrics.drops["bad_language"] += 1
+			continue
+		
+		# Normalize transcription
+		transcription = normalize(parse[1], config)
+		
+		if transcription == "":
+			if metrics is not None:
+				metrics.drops["eliminate" if is_eliminated(parse[1], config) else "empty"] += 1
+			continue
+		
+		# Yield (language, transcription) pair
+		yield (lang, transcription)
+
+def iter_tokenized(data, config=None, metrics=None):
+	'''
+	Yields (tokens, tag) for each space-separated transcription
+	in (tag, transcriptions) pairs, skipping those too short
+	'''
+	for (tag, transcriptions) in data:
+		for tokens in tokenize_all(transcriptions.split(), tag, config): # Splits transcriptions w/ spaces
+			if tokens != []:
+				yield (tokens, tag)
+			elif metrics is not None:
+				metrics.drops["too_short"] += 1
+
+def tokenize(transcription, tag, config=None):
+	'''
+	Splits transcription into symbols, adds
+	start/end symbols.
+	
+	Arguments:
+	* transcription - String to tokenize
+	* tag - 3-letter language tag
+	
+	Return:
+	* list of tokens
+	'''
+	return tokenize_all([transcription], tag, config)[0]
+
+def tokenize_all(transcriptions, tag, config=None):
+	'''
+	Tokenizes batch of transcriptions sharing one tag
+	(see tokenize())
+	
+	Arguments:
+	* transcriptions - List of strings to tokenize
+	* tag - 3-letter language tag
+	
+	Return:
+	* List of token lists, empty where transcription is too short
+	'''
+	config = config or DEFAULT_CONFIG
+	actions = config.tokenize_actions.get
+	can_voiceless = config.can_voiceless
+	min_length = config.min_length
+	stop_at_bar = tag == "YEY" # YEY: | used like /
+	result = []
+	
+	for transcription in transcriptions:
+		in_paren = False
+		deleted = True # Last character deleted or space
+		tokens = []
+		#tokens.append("#")
+		
+		for c in transcription:
+			action = actions(c, APPEND)
+			if in_paren:
+				if action == CLOSE or action == QUOTE:
+					in_paren = False
+				deleted = True
+			elif action == APPEND:
+				tokens.append(c)
+				deleted = False
+			elif action == SKIP:
+				deleted = True
+			elif action == OPEN or action == QUOTE:
+				in_paren = True
+				deleted = True
+			elif action == CLOSE:
+				deleted = True
+			elif action == SPACE:
+				if len(tokens) > 0 and tokens[-1] != "#":
+					tokens.append("#")
+				deleted = True
+			elif action == STOP:
+				break
+			elif action == BAR:
+				if stop_at_bar:
+					break
+				deleted = True
+			elif not deleted and len(tokens) > 0 and tokens[-1] != "#": # ATTACH
+				last = tokens[-1]
+				if action == ATTACH_VOICELESS and last[0] not in can_voiceless: # checks to make sure voicelessness marker can attach
+					continue
+				if c == last[-1]: # skips duplicate markers
+					continue
+				tokens[-1] = last + c
+		
+		if len(tokens) != 0 and tokens[-1] == "#":
+			tokens.pop()
+			
+		#tokens = [token for token in tokens if token in ALLOW]
+		if len(tokens) >= min_length:
+			result.append(tokens)
+		else:
+			result.append([])
+	
+	return result
+
+def add_tag(tokens, tag, config=None):
+	'''
+	Appends "￨" (OpenNMT feature delimiter)
+	followed by tag to each element in list
+	
+	Arguments:
+	* tokens - List of elements to be tagged
+	* tag - Tag to append to elements
+	
+	Return:
+	* Tagged list
+	'''
+	config = config or DEFAULT_CONFIG
+	return [token + FEATURE_DELIMITER + tag.replace(" ", "") for token in tokens if len(tokens) >= config.min_length]
+
+def process_chunk(args):
+	'''
+	Worker: normalizes, tokenizes and dedups chunk of input lines
+	
+	Arguments:
+	* args - Triple (list of lines, Config, True to collect Metrics)
+	
+	Return:
+	* Triple (list of (tokens, tag) pairs, Counter of lines excluded
+	per language, Metrics or None)
+	'''
+	(lines, config, collect_metrics) = args
+	excluded = collections.Counter()
+	metrics = Metrics() if collect_metrics else None
+	processed = list(process_lines(lines, config, 1, True, excluded, metrics))
+	if metrics is not None:
+		metrics.close_chain()
+		# Lines were read by the main process
+		del metrics.times["read"]
+		del metrics.items["read"]
+		# Reported apart, so "dedup" counts the same items for any jobs
+		metrics.times["chunk_dedup"] = metrics.times.pop("dedup")
+		metrics.items["chunk_dedup"] = metrics.items.pop("dedup")
+	return (processed, excluded, metrics)
+
+def chunks(f, size):
+	'''
+	Groups lines of f into lists of at most size lines
+	'''
+	chunk = []
+	for line in f:
+		chunk.append(line)
+		if len(chunk) >= size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+def iter_processed(f, jobs=1, excluded=None, config=None, metrics=None):
+	'''
+	Yields (tokens, tag) pairs from input file, fanning chunks
+	of lines out to jobs worker processes if jobs > 1. Pairs are
+	yielded in input order; duplicates across chunks remain.
+	Lines removed by language are counted in excluded, if given.
+	'''
+	config = config or DEFAULT_CONFIG
+	
+	if metrics is not None:
+		f = metrics.timed(f, "read")
+	
+	if jobs <= 1:
+		data = iter_transcriptions(f, excluded, config, metrics)
+		if metrics is not None:
+			data = metrics.timed(data, "normalize")
+		tokenized = iter_tokenized(data, config, metrics)
+		if metrics is not None:
+			tokenized = metrics.timed(tokenized, "tokenize")
+		yield from tokenized
+		return
+	
+	def results(pending):
+		(processed, chunk_excluded, chunk_metrics) = pending.get()
+		if excluded is not None:
+			excluded.update(chunk_excluded)
+		if metrics is not None:
+			metrics.merge(chunk_metrics)
+		return processed
+	
+	def parallel():
+		with multiprocessing.Pool(jobs) as pool:
+			pending = collections.deque()
+			for chunk in chunks(f, CHUNK_SIZE):
+				pending.append(pool.apply_async(process_chunk, ((chunk, config, metrics is not None),)))
+				while len(pending) > 2 * jobs: # Bounds chunks in flight
+					yield from results(pending.popleft())
+			while pending:
+				yield from results(pending.popleft())
+	
+	if metrics is not None:
+		yield from metrics.timed(parallel(), "wait")
+	else:
+		yield from parallel()
+
+def process_lines(lines, config=None, jobs=1, exact=True, excluded=None, metrics=None):
+	'''
+	Normalizes, tokenizes and dedups tagged transcriptions
+	
+	Arguments:
+	* lines - Iterable of lines formatted tag⦀transcription
+	* config - Config to use (default: DEFAULT_CONFIG)
+	* jobs - Number of worker processes
+	* exact - Compare entries on fingerprint match (default) rather
+	than trusting fingerprints, which can drop distinct entries
+	(see SeenSet)
+	* excluded - Optional Counter of lines removed per language
+	* metrics - Optional Metrics to collect timings and drops in
+	
+	Return:
+	* Iterator over unique (tokens, tag) pairs, in input order
+	'''
+	unique_pairs = iter_unique(iter_processed(lines, jobs, excluded, config, metrics), exact, metrics)
+	if metrics is not None:
+		unique_pairs = metrics.timed(unique_pairs, "dedup")
+	return unique_pairs
+
+def format_line(tokens, tag, config=None):
+	'''
+	Returns tokens formatted as line of OpenNMT input
+	'''
+	return " ".join(add_tag(tokens, tag, config)) + "\n"
+
+class CorpusStats:
+	'''
+	Counts collected by build_corpus()
+	
+	Attributes:
+	* token_counts - Counter of tokens in unique transcriptions
+	* tag_counts - Counter of unique transcriptions per language
+	* excluded - Counter of lines removed per language (BAD_LANGUAGE)
+	* langs_allowed - Set of languages meeting LANG_MIN
+	'''
+	
+	def __init__(self):
+		self.token_counts = collections.Counter()
+		self.tag_counts = collections.Counter() # Counts numbers of valid transcripts with each language tag
+		self.excluded = collections.Counter() # Counts lines removed from each language in BAD_LANGUAGE
+		self.langs_allowed = set()
+
+def build_corpus(lines, w, config=None, stream=False, jobs=1, exact=True, spill_dir=None, metrics=None, binary=None):
+	'''
+	Processes tagged transcriptions and writes those of languages
+	with at least config.lang_min unique transcriptions to w
+	
+	Arguments:
+	* lines - Iterable of lines formatted tag⦀transcription
+	* w - Output file
+	* stream - If True, entries are spilled to a temporary file
+	(in spill_dir) instead of being held in memory
+	* binary - Optional phoncorpus.CorpusWriter also receiving
+	written entries
+	* jobs, exact, metrics - See process_lines()
+	
+	Return:
+	* CorpusStats
+	'''
+	config = config or DEFAULT_CONFIG
+	stats = CorpusStats()
+	processed = process_lines(lines, config, jobs, exact, stats.excluded, metrics)
+	clock = time.perf_counter
+	
+	if stream:
+		# Pass 1: dedups, counts and spills tagged entries to disk
+		with tempfile.TemporaryFile("w+", encoding="utf-8", dir=spill_dir) as spill:
+			start = clock()
+			spill_time = 0.0
+			for (tokens, tag) in processed:
+				count_tokens(tokens, stats.token_counts)
+				stats.tag_counts[tag] += 1 # Increments language count
+				if metrics is not None:
+					spill_start = clock()
+					spill.write(tag + DELIMITER + format_line(tokens, tag, config))
+					spill_time += clock() - spill_start
+				else:
+					spill.write(tag + DELIMITER + format_line(tokens, tag, config))
+			
+			stats.langs_allowed = {lang for lang, count in stats.tag_counts.items() if count >= config.lang_min}
+			
+			if metrics is not None:
+				pulled = metrics.cumulative[metrics.chain[-1]] # Time spent in processing stages
+				metrics.close_chain()
+				metrics.times["count"] += clock() - start - pulled - spill_time
+			
+			# Pass 2: copies entries of languages meeting LANG_MIN
+			start = clock()
+			spill.seek(0)
+			for line in spill:
+				(tag, tokens_tagged) = line.split(DELIMITER, 1)
+				if tag in stats.langs_allowed:
+					w.write(tokens_tagged)
+					if binary is not None:
+						binary.add([token.rpartition(FEATURE_DELIMITER)[0] for token in tokens_tagged.split()], tag)
+			if metrics is not None:
+				metrics.times["write"] += spill_time + clock() - start
+	else:
+		data_processed = list(processed)
+		if metrics is not None:
+			metrics.close_chain()
+		
+		start = clock()
+		for (tokens, tag) in data_processed:
+			count_tokens(tokens, stats.token_counts)
+			stats.tag_counts[tag] += 1 # Increments language count
+		
+		stats.langs_allowed = {lang for lang, count in stats.tag_counts.items() if count >= config.lang_min}
+		if metrics is not None:
+			metrics.times["count"] += clock() - start
+		
+		start = clock()
+		for (tokens, tag) in data_processed:
+			if tag in stats.langs_allowed:
+				w.write(format_line(tokens, tag, config))
+				if binary is not None:
+					binary.add(tokens, tag)
+		if metrics is not None:
+			metrics.times["write"] += clock() - start
+	
+	if metrics is not None:
+		metrics.items["count"] = sum(stats.tag_counts.values())
+		metrics.items["write"] = sum(stats.tag_counts[lang] for lang in stats.langs_allowed)
+		metrics.drops["below_lang_min"] += metrics.items["count"] - metrics.items["write"]
+	
+	return stats
@@ -1,27 +1,148 @@
 '''
 Splits newline-separated data into training, validation, optional test
 sets (80-10-10 or 90-10).
-split.py data_path training_path val_path (test_path)
+split.py [-s seed] [-r ratios] [--stratify] data_path training_path val_path (test_path)
+
+Each line is assigned by a stable hash of its content and the seed
+alone, in one pass with constant memory, so a split can be reproduced
+exactly and rebuilding the corpus never moves an existing line to
+another set. This is the supported mode for corpora that grow. ratios
+are given as train,val(,test) percentages, eg -r 80,10,10.
+
+--stratify is NOT incremental: it is for one-off splits of a fixed
+corpus only. The language tag (￨TAG feature written by process.py) of
+each line is read in a first pass, and languages with no more than
+SMALL_LANGUAGE lines get exactly their share of each set (at least one
+validation line if they have two or more lines), taking the lines with
+the lowest hashes. The cutoffs depend on each small language's line
+count, so when lines are added, existing lines of small languages can
+move between sets. It also keeps up to SMALL_LANGUAGE hashes per
+language in memory. Larger languages are split by hash as without
+--stratify.
 '''
-import random
 import sys
 import io
+import getopt
+import hashlib
+from collections import Counter
+
+BUFFER_SIZE = 1 << 20 # Bytes buffered per file
+SMALL_LANGUAGE = 1000 # Max lines of language split exactly with --stratify
+FEATURE_DELIMITER = "￨".encode("utf-8") # Separates token from tag (OpenNMT feature)
+HASH_RANGE = 1 << 64
+
+def line_hash(line, key):
+	'''
+	Returns stable 64-bit hash of line (without line break)
+	'''
+	return int.from_bytes(hashlib.blake2b(line.rstrip(b"\r\n"), digest_size=8, key=key).digest(), "little")
+
+def line_tag(line):
+	'''
+	Returns language tag of line in process.py output
+	'''
+	return line.split(b" ", 1)[0].rstrip(b"\r\n").rpartition(FEATURE_DELIMITER)[2]
+
+def get_thresholds(f, key, val_ratio, test_ratio):
+	'''
+	Computes per-language hash thresholds for --stratify
+
+	Return:
+	* Dict of tag -> (val threshold, test threshold); lines with
+	hash below val threshold go to validation set, below test
+	threshold to test set. Languages not in dict use ratios.
+	'''
+	counts = Counter()
+	hashes = dict() # Hashes of lines of languages with <= SMALL_LANGUAGE lines
+
+	for line in f:
+		tag = line_tag(line)
+		counts[tag] += 1
+		if counts[tag] <= SMALL_LANGUAGE:
+			hashes.setdefault(tag, []).append(line_hash(line, key))
+		elif tag in hashes:
+			del hashes[tag]
+
+	thresholds = dict()
+	for (tag, values) in hashes.items():
+		values.sort()
+		values.append(HASH_RANGE)
+		n = len(values) - 1
+
+		val = round(val_ratio * n)
+		test = round(test_ratio * n)
+		if n >= 2 and val_ratio > 0:
+			val = max(val, 1)
+		while n >= 2 and val + test >= n: # Keeps at least one training line
+			if test > 0:
+				test -= 1
+			else:
+				val -= 1
 
-f = io.open(sys.argv[1], "r", encoding="utf-8")
-r = io.open(sys.argv[2], "w", encoding="utf-8")
-v = io.open(sys.argv[3], "w", encoding="utf-8")
-
-if len(sys.argv) >= 5:
-	s = io.open(sys.argv[4], "w", encoding="utf-8")
-else:
-	s = None
-
-for line in f:
-	n = random.randint(0, 9)
-	if n == 0:
-		v.write(line)
-	elif n == 1 and s is not None:
-		s.write(line)
+		thresholds[tag] = (values[val], values[val + test])
+
+	return thresholds
+
+if __name__ == "__main__":
+	USAGE = "split.py [-s seed] [-r ratios] [--stratify] data_path training_path val_path (test_path)\n" \
+		"  --stratify: exact per-language shares for small languages; non-incremental\n" \
+		"  (adding data can move existing lines between sets), two passes"
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "s:r:", ["seed=", "ratios=", "stratify"])
+	except getopt.GetoptError:
+		print(USAGE)
+		sys.exit(1)
+	if len(args) not in (3, 4):
+		print(USAGE)
+		sys.exit()
+
+	seed = "0"
+	ratios = None
+	stratify = False
+	for opt, arg in opts:
+		if opt in ("-s", "--seed"):
+			seed = arg
+		elif opt in ("-r", "--ratios"):
+			ratios = [float(ratio) for ratio in arg.split(",")]
+		elif opt == "--stratify":
+			stratify = True
+
+	if ratios is None:
+		ratios = [80, 10, 10] if len(args) == 4 else [90, 10]
+	if len(ratios) == 2:
+		ratios.append(0)
+	val_ratio = ratios[1] / sum(ratios)
+	test_ratio = ratios[2] / sum(ratios) if len(args) == 4 else 0 # No test set: test share goes to training
+
+	key = seed.encode("utf-8")[:64]
+
+	thresholds = dict()
+	if stratify:
+		with io.open(args[0], "rb", buffering=BUFFER_SIZE) as f:
+			thresholds = get_thresholds(f, key, val_ratio, test_ratio)
+	default = (int(val_ratio * HASH_RANGE), int((val_ratio + test_ratio) * HASH_RANGE))
+
+	f = io.open(args[0], "rb", buffering=BUFFER_SIZE)
+	r = io.open(args[1], "wb", buffering=BUFFER_SIZE)
+	v = io.open(args[2], "wb", buffering=BUFFER_SIZE)
+
+	if len(args) >= 4:
+		s = io.open(args[3], "wb", buffering=BUFFER_SIZE)
 	else:
-		r.write(line)
-	
+		s = None
+
+	for line in f:
+		n = line_hash(line, key)
+		(val, test) = thresholds.get(line_tag(line), default) if stratify else default
+		if not line.endswith(b"\n"):
+			line += b"\n"
+		if n < val:
+			v.write(line)
+		elif n < test and s is not None:
+			s.write(line)
+		else:
+			r.write(line)
+
+	for out in (f, r, v, s):
+		if out is not None:
+			out.close()
@@ -16,17 +16,45 @@ import sys
 import os
 import unicodedata
 import pickle
+import multiprocessing
+import functools
+import hashlib
+import json
+import io
+import tempfile
+from collections import deque
 
 DIR = "Language"
 SAVE = None # Name of file to save language/transcript pairs
+WORKERS = 1 # Number of processes parsing files
+CACHE = None # Directory of cached tables (None = no cache)
 DELIMITER = "⦀" # Separates language name from transcript
+SKIP_FOLDERS = ["HGM"] # langs w/o transcriptions
+READ_SIZE = 1 << 16 # Characters fed to parser at a time when streaming
+PARSER_VERSION = 2 # Bump when parsing/selection changes, to invalidate cached tables
 
+# Set of substrings that suggest transcript is actually English text
+BAD_TRANSCRIPT = {"transcript", "available"}
 
-if len(sys.argv) != 3 or sys.argv[1].lower() != "-save":
-	print("ucla_parse.py -save [file]")
-	sys.exit()
-else:
-	SAVE = sys.argv[2]
+# Pages and expected transcripts for ucla_parse.py -check (see check())
+CHECK_PAGE = "<title>UCLA Phonetics Lab Xyz</title><table>{}</table>"
+CHECK_PAGES = [
+	# Row of empty cells with wrong number of cells, then short row
+	(CHECK_PAGE.format("<tr><th>a b</th></tr><tr><td></td><td></td></tr><tr><td>english5</td></tr>"), ["english5"]),
+	# Empty cells: left out of row, so short rows are skipped
+	(CHECK_PAGE.format("<tr><th>Gloss</th><th>IPA</th></tr><tr><td></td><td>pa</td></tr>"
+		"<tr><td>dog</td><td>ta</td></tr><tr><td></td><td></td></tr><tr><td>cat</td><td></td></tr>"
+		"<tr><td>fish</td><td>ka</td></tr>"), ["ta", "ka"]),
+	# Empty header cell: later header cells shift left, as in the original parser
+	(CHECK_PAGE.format("<tr><th></th><th>IPA</th></tr><tr><td>a</td><td>pa</td></tr>"), ["a"]),
+	# Cell-less row with wrong number of cells between rows
+	(CHECK_PAGE.format("<tr><th>Gloss</th><th>IPA</th></tr><tr><td>a</td><td>pa</td></tr>"
+		"<tr><td></td></tr><tr><td>b</td><td>ba</td></tr>"), ["pa", "ba"]),
+	# Title after table
+	("<table><tr><th>Gloss</th><th>Xyz</th></tr><tr><td>a</td><td>pa</td></tr></table><title>UCLA Phonetics Lab Xyz</title>", ["pa"]),
+	# Empty table
+	(CHECK_PAGE.format(""), [])
+]
 
 class UCLADataParser(HTMLParser):
 	'''
@@ -121,14 +149,168 @@ class UCLADataParser(HTMLParser):
 			if self.language.isspace():
 				self.language = "null"
 
-def get_transcript_index(parse):
+class UCLAColumnParser(HTMLParser):
+	'''
+	Streaming alternative to UCLADataParser that keeps only the
+	transcript column. The column is chosen (get_transcript_index())
+	as soon as the header row and page title have been parsed; after
+	that only the chosen cell of each row is kept, and rows are
+	appended to rows as they complete.
+	
+	Row rules (shared by streaming and table mode): a row is kept if
+	its number of cells equals that of the first row and at least one
+	cell has data; a row holds the first data of each cell with data,
+	so empty cells are left out.
+	
+	Methods:
+	* feed(string) - Feeds (part of) HTML string for parsing
+	
+	Attributes:
+	* rows - Deque of transcript column cells not yet consumed
+	* table - With table=True, list of all kept rows (header first);
+	no column is chosen and rows stays empty
+	* language - Name of language as represented in fed HTML
+	* index - Index of transcript column, once chosen
+	* done - True once it is known no (more) rows will be found
+	'''
+	
+	def __init__(self, table=False):
+		self.rows = deque()
+		self.table = [] if table else None
+		self.language = ""
+		self.index = None
+		self.done = False
+		
+		# Internal attributes
+		self.in_cell = False # True if currently parsing inside cell
+		self.in_title = False # True if currently parsing in page title
+		self.title_seen = False # True after </title>
+		self.col = 0 # Column iterator
+		self.header_cols = 0 # Number of columns in header
+		self.header = None # Header row
+		self.buffer = [] # Full rows completed before column was chosen
+		self.cells = [] # Cells of current row (only chosen cell once column is chosen)
+		self.num_cells = 0 # Number of cells with data in current row
+		self.text = [] # Pending data, handled at next tag
+		
+		HTMLParser.__init__(self)
+	
+	def handle_starttag(self, tag, atr):
+		self.flush_text()
+		if tag == "th" or tag == "td":
+			# Beginning of header or data cell
+			self.in_cell = True
+		elif tag == "tr":
+			# Beginning of row
+			self.col = 0 # Resets column iterator
+			self.cells = []
+			self.num_cells = 0
+		elif tag == "title":
+			# Beginning of page title
+			self.in_title = True
+	
+	def handle_endtag(self, tag):
+		self.flush_text()
+		if tag == "th" or tag == "td":
+			# End of cell
+			self.col += 1 # Increments column iterator
+			self.in_cell = False
+		elif tag == "tr":
+			# End of row
+			if self.header_cols == 0:
+				# Number of header columns not yet calculated
+				self.header_cols = self.col
+			if self.num_cells > 0 and self.col == self.header_cols:
+				self.add_row(self.cells)
+			self.cells = []
+			self.num_cells = 0
+		elif tag == "title":
+			# End of page title
+			self.in_title = False
+			self.title_seen = True
+			if self.header is not None and self.index is None and self.table is None:
+				self.choose_column()
+	
+	def handle_data(self, data):
+		# Text is only handled at next tag, so text split between
+		# fed chunks is treated the same as in UCLADataParser
+		self.text.append(data)
+	
+	def handle_comment(self, data):
+		self.flush_text()
+	
+	def flush_text(self):
+		'''
+		Handles data since last tag (see UCLADataParser.handle_data())
+		'''
+		if not self.text:
+			return
+		text = "".join(self.text)
+		self.text = []
+		
+		if self.in_cell:
+			if self.num_cells <= self.col:
+				# First element in cell
+				if self.index is None:
+					self.cells.append(text)
+				elif self.num_cells == self.index:
+					self.cells = [text]
+				self.num_cells += 1
+		elif self.in_title:
+			# Attempt to retrieve name of language
+			try:
+				self.language = text.split(" ", 3)[3].lower()
+			except:
+				self.language = "null"
+			if self.language.isspace():
+				self.language = "null"
+	
+	def add_row(self, cells):
+		'''
+		Handles complete row with correct number of cells
+		'''
+		if self.done:
+			return
+		if self.table is not None:
+			self.table.append(cells)
+		elif self.header is None:
+			self.header = cells
+			if self.title_seen:
+				self.choose_column()
+		elif self.index is None:
+			self.buffer.append(cells)
+		elif self.num_cells > self.index:
+			self.rows.append(cells[0])
+	
+	def choose_column(self):
+		'''
+		Chooses transcript column from header and language,
+		releasing rows buffered until then
+		'''
+		self.index = get_transcript_index([self.header], self.language)
+		if self.index is None:
+			self.done = True
+		else:
+			self.rows.extend(row[self.index] for row in self.buffer if len(row) > self.index)
+		self.buffer = []
+	
+	def close(self):
+		HTMLParser.close(self)
+		self.flush_text()
+		if self.header is not None and self.index is None and not self.done and self.table is None:
+			# No title found - column chosen without it
+			self.choose_column()
+		self.done = True
+
+def get_transcript_index(table, language):
 	'''
 	Guesses index of column of parsed UCLA table that
 	has transcripts of words in target language based
 	on header content and column positions
 	
 	Arguments:
-	* parse - Instance of UCLADataParser() that has been fed HTML data
+	* table - Table extracted by parse_html() (or at least its header row)
+	* language - Language name extracted by parse_html()
 	
 	Return:
 	* Integer value of target column's index
@@ -137,13 +319,13 @@ def get_transcript_index(parse):
 	cols = [] # Stores indices of columns that have neither favorable nor disfavorable indicators
 	
 	# Set of header substrings that suggest column contains transcripts
-	FAVORABLE = {"ipa", "transcription", "transcript", "phonetic", parse.language}
+	FAVORABLE = {"ipa", "transcription", "transcript", "phonetic", language}
 	
 	# Set of header substrings that suggest column does not contain transcripts
 	DISFAVORABLE = {"entry", "sound", "orthography", "gloss", "illustrated", "note", "english", "semantic", "romanization", "phonem", "transliteration", "sound", "click", "potential", "recording", "root", "ending", "section", "manner", "orthographic", " script", "contrast", "board"}
 	
-	for i, header in enumerate(parse.table[0]): # Enumerate through headers
-		if any(substring.lower() in header.lower() for substring in DISFAVORABLE):# or parse.table[i][1].isdigit(): # or (len(table[0]) > 2 and row == len(table[0]) - 1):
+	for i, header in enumerate(table[0]): # Enumerate through headers
+		if any(substring.lower() in header.lower() for substring in DISFAVORABLE):# or table[i][1].isdigit(): # or (len(table[0]) > 2 and row == len(table[0]) - 1):
 			# Header contains disfavorable string or col's first non-header row contains number or is last col of >2 col table
 			continue
 		elif any(substring.lower() in header.lower() for substring in FAVORABLE):
@@ -159,45 +341,218 @@ def get_transcript_index(parse):
 	else:
 		return None
 
-def get_transcripts(f):
+class TableCache:
+	'''
+	Persistent cache of tables extracted from UCLA HTML files,
+	one JSON file per HTML file in the cache directory. An entry
+	is valid for a file with the same path, written by the same
+	PARSER_VERSION, and either the same size and mtime or the same
+	content hash.
+	
+	Methods:
+	* get(path) - Returns (table, language) for HTML file, parsing
+	it only if no valid cache entry exists
+	'''
+	
+	def __init__(self, directory):
+		self.directory = directory
+		os.makedirs(directory, exist_ok=True)
+	
+	def entry_path(self, path):
+		name = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+		return os.path.join(self.directory, name + ".json")
+	
+	def get(self, path):
+		stat = os.stat(path)
+		entry_path = self.entry_path(path)
+		
+		try:
+			with open(entry_path, "r", encoding="utf-8") as f:
+				entry = json.load(f)
+		except (OSError, ValueError):
+			entry = None
+		
+		if entry is not None and entry.get("version") != PARSER_VERSION:
+			entry = None # Written by another version of the parser
+		
+		if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+			return (entry["table"], entry["language"])
+		
+		raw = open(path, "rb").read()
+		digest = hashlib.sha256(raw).hexdigest()
+		
+		if entry is None or entry["sha256"] != digest:
+			# Decodes as open(path, "r") would
+			(table, language) = parse_html(io.TextIOWrapper(io.BytesIO(raw)).read())
+			entry = {"version": PARSER_VERSION, "path": os.path.abspath(path), "sha256": digest, "table": table, "language": language}
+		
+		entry["size"] = stat.st_size
+		entry["mtime"] = stat.st_mtime_ns
+		
+		# Written to temporary file first so readers never see partial entry
+		temp_path = entry_path + "." + str(os.getpid())
+		with open(temp_path, "w", encoding="utf-8") as f:
+			json.dump(entry, f, ensure_ascii=False)
+		os.replace(temp_path, entry_path)
+		
+		return (entry["table"], entry["language"])
+
+def parse_html(string):
+	'''
+	Extracts table and language name from UCLA HTML string, with
+	the row rules of iter_transcripts() (see UCLAColumnParser)
+	
+	Return:
+	* Pair (table, language)
+	'''
+	parser = UCLAColumnParser(table=True)
+	parser.feed(string) # Feeds string to parser
+	parser.close()
+	return (parser.table, parser.language)
+
+def is_transcript(text):
+	'''
+	Returns False if table cell is empty or appears to be
+	English text rather than transcript
+	'''
+	return not (text.isspace() or any(substring.lower() in text.lower() for substring in BAD_TRANSCRIPT))
+
+def select_transcripts(table, language):
+	'''
+	Returns valid transcripts in transcript column of
+	table extracted by parse_html(); rows too short to have
+	the column are skipped, as in iter_transcripts()
+	
+	Return:
+	* List of untokenized transcript strings, or empty list
+	'''
+	index = get_transcript_index(table, language) if table else None # Gets index of transcript col
+	
+	if index == None: # No transcript col index
+		return []
+	else:
+		# Returns list of valid transcripts in indicated column 
+		return [row[index] for row in table[1:] if len(row) > index and is_transcript(row[index])]
+
+def iter_transcripts(path):
+	'''
+	Yields valid transcripts from UCLA Phon Lab HTML file as
+	rows are parsed, feeding the file to UCLAColumnParser in
+	pieces and stopping early if there is no transcript column
+	'''
+	parser = UCLAColumnParser()
+	
+	with open(path, "r") as f:
+		while not parser.done:
+			string = f.read(READ_SIZE)
+			if string == "":
+				parser.close()
+			else:
+				parser.feed(string)
+			while parser.rows:
+				text = parser.rows.popleft()
+				if is_transcript(text):
+					yield text
+
+def get_transcripts(f, cache=None):
 	'''
 	Returns list of transcripts from UCLA Phon Lab
 	HTML file
 	
 	Arguments:
-	* f - DirEntry object (ie returned from os.scandir())
+	* f - DirEntry object (ie returned from os.scandir()) or path
+	* cache - Optional TableCache holding extracted tables; if
+	not given, file is parsed with iter_transcripts()
 	
 	Return:
 	* List of untokenized transcript strings, or empty list
 	'''
+	if cache is not None:
+		(table, language) = cache.get(f)
+		return select_transcripts(table, language)
 	
-	# Set of substrings that suggest transcript is actually English text
-	BAD_TRANSCRIPT = {"transcript", "available"}
+	return list(iter_transcripts(f))
+
+def check():
+	'''
+	Checks that iter_transcripts() and the cached path (parse_html()
+	and select_transcripts()) return the expected transcripts for
+	CHECK_PAGES, feeding pages whole and in one-character pieces
 	
-	string = open(file.path, "r").read() # Gets file contents in string
-	parser = UCLADataParser()
-	parser.feed(string) # Feeds string to parser
-	index = get_transcript_index(parser) # Gets index of transcript col
-	parser.close()
+	Return:
+	* Number of failed pages
+	'''
+	global READ_SIZE
+	failures = 0
+	read_size = READ_SIZE
 	
-	if index == None: # No transcript col index
-		return []
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, "check.html")
+		for (i, (page, expected)) in enumerate(CHECK_PAGES):
+			with open(path, "w") as f:
+				f.write(page)
+			results = [select_transcripts(*parse_html(page))]
+			for READ_SIZE in (read_size, 1):
+				results.append(list(iter_transcripts(path)))
+			READ_SIZE = read_size
+			if any(result != expected for result in results):
+				print("Page", i, "expected", expected, "got", results)
+				failures += 1
+	
+	return failures
+
+def get_files(directory):
+	'''
+	Returns paths of HTML files in archive, sorted by
+	folder (language) and file name
+	'''
+	paths = []
+	for folder in sorted(os.scandir(directory), key=lambda entry: entry.name):
+		# Iterates over folders, which correspond to languages, in HTML directory
+		if os.path.basename(folder.name) in SKIP_FOLDERS:
+			continue
+		for file in sorted(os.scandir(folder.path), key=lambda entry: entry.name):
+			paths.append(file.path)
+	return paths
+
+def get_lines(path, cache=None):
+	'''
+	Returns output lines (TAG⦀transcript) for HTML file
+	'''
+	tag = os.path.basename(path).split("_")[0].upper()
+	return [tag + DELIMITER + transcript.replace("\n", " ") + "\n" for transcript in get_transcripts(path, cache)]
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+	if args == ["-check"]:
+		failures = check()
+		print(len(CHECK_PAGES) - failures, "of", len(CHECK_PAGES), "check pages OK")
+		sys.exit(1 if failures else 0)
+	
+	while len(args) >= 2 and args[0].lower() in ("-save", "-workers", "-cache"):
+		if args[0].lower() == "-save":
+			SAVE = args[1]
+		elif args[0].lower() == "-workers":
+			WORKERS = int(args[1])
+		else:
+			CACHE = args[1]
+		args = args[2:]
+	
+	if SAVE is None or args:
+		print("ucla_parse.py -save [file] (-workers [n]) (-cache [dir])")
+		print("ucla_parse.py -check")
+		sys.exit()
+	
+	paths = get_files(DIR)
+	get_file_lines = functools.partial(get_lines, cache=TableCache(CACHE) if CACHE else None)
+	
+	f = open(SAVE, "w")
+	if WORKERS > 1:
+		# Files are parsed in parallel; results are written in order as they finish
+		with multiprocessing.Pool(WORKERS) as pool:
+			for lines in pool.imap(get_file_lines, paths):
+				f.writelines(lines)
 	else:
-		# Returns list of valid transcripts in indicated column 
-		return [row[index] for row in parser.table[1:] if not (row[index].isspace() or any(substring.lower() in row[index].lower() for substring in BAD_TRANSCRIPT))]
-
-data = []	
-
-for folder in os.scandir(DIR):
-	# Iterates over folders, which correspond to languages, in HTML directory
-	if os.path.basename(folder.name) in ["HGM"]: # langs w/o transcriptions
-		continue
-	for file in os.scandir(folder.path):
-		#print(file.path)
-		transcripts = get_transcripts(file)
-		if transcripts != None:
-			data.extend([(transcript, os.path.basename(file.name).split("_")[0].upper()) for transcript in transcripts])
-	
-f = open(SAVE, "w")
-for (transcript, tag) in data:
-	f.write(tag + DELIMITER + transcript.replace("\n", " ") + "\n")
+		for path in paths:
+			f.writelines(get_file_lines(path))
+	f.close()
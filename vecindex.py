@@ -0,0 +1,266 @@
+'''
+Approximate nearest-neighbor search for normalized vectors
+(inverted file index, numpy only)
+
+The vectors are partitioned by spherical k-means into nlist lists.
+A query is scored against the list centroids, and only the vectors
+of the nprobe closest lists are scored exactly. nprobe trades recall
+for latency: nprobe = nlist is exact search. By default nprobe is
+NPROBE_SHARE of the lists. Queries are grouped by the lists they
+probe, so each list is scored against all its queries in one matrix
+multiply.
+
+Measured recall@10 and time per query against batched exact_search,
+for 1000 queries, nlist = sqrt(n), default nprobe:
+    vectors          n x dim    nprobe  recall  batched  exact    single  exact
+    random         50k x 50     22/223  0.60    0.14 ms  0.35 ms  0.64 ms  1.0 ms
+    clustered      50k x 50     22/223  1.00    0.14 ms  0.35 ms  0.68 ms  1.0 ms
+    random        200k x 100    45/447  0.50    0.45 ms  1.6 ms   4.3 ms  10.5 ms
+    clustered     200k x 100    45/447  1.00    0.39 ms  1.5 ms   4.2 ms  10.9 ms
+(clustered: 1000 gaussian clusters; queries are perturbed vectors)
+Recall is lowest for unstructured (random) vectors; real embeddings
+cluster, which is where the index pays off. Build the index only if it
+is faster than exact search for the expected query batches (see
+word_vectors.build_index()).
+
+Matrices with fewer than EXACT_THRESHOLD rows are not partitioned
+and are always searched exactly.
+
+    index = IVFIndex.build(vectors)
+    ids, scores = index.search(vectors, queries, 10)[0]
+    index.save("vectors.index")
+    index = IVFIndex.load("vectors.index") # Both use vectors.index.npz
+
+The index only stores the partition, so search is given the same
+vectors it was built from. Quantized vectors (eg int8) are searched
+by passing their per-row scales; scores are then approximate.
+'''
+
+import numpy
+
+EXACT_THRESHOLD = 10000 # Fewer vectors than this are searched exactly
+TRAIN_PER_LIST = 64 # Training sample size per list for k-means
+ITERATIONS = 10 # k-means iterations
+BLOCK_SIZE = 1 << 14 # Rows converted to float32 and scored at a time
+NPROBE_SHARE = 0.1 # Default share of lists probed per query
+SMALL_BATCH = 4 # Up to this many queries are searched one by one rather than grouped by list
+
+def top_k(scores, k):
+    '''
+    Returns the indices of the k largest scores, best first
+    '''
+    k = min(k, len(scores))
+    if k <= 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    if k < len(scores):
+        best = numpy.argpartition(-scores, k - 1)[:k]
+    else:
+        best = numpy.arange(len(scores))
+    return best[numpy.argsort(-scores[best], kind="stable")]
+
+def score(vectors, queries, scales=None):
+    '''
+    Returns (queries x vectors) matrix of dot products, converting
+    vectors to float32 a block of rows at a time
+
+    Arguments:
+    * scales - Per-row scale factors of quantized vectors
+    '''
+    if vectors.dtype == numpy.float32 and scales is None:
+        return queries.dot(vectors.T)
+
+    scores = numpy.empty((len(queries), len(vectors)), dtype=numpy.float32)
+    for start in range(0, len(vectors), BLOCK_SIZE):
+        block = numpy.asarray(vectors[start:start + BLOCK_SIZE], dtype=numpy.float32)
+        scores[:, start:start + BLOCK_SIZE] = queries.dot(block.T)
+    if scales is not None:
+        scores *= scales
+    return scores
+
+def exact_search(vectors, queries, k, scales=None):
+    '''
+    Brute-force search with one matrix multiply
+
+    Return:
+    * List of (ids, scores) arrays, one per query, best first
+    '''
+    scores = score(vectors, queries, scales)
+    results = []
+    for row in scores:
+        best = top_k(row, k)
+        results.append((best, row[best]))
+    return results
+
+def assign(vectors, centroids):
+    '''
+    Returns index of the closest centroid of each vector
+    '''
+    lists = numpy.empty(len(vectors), dtype=numpy.int64)
+    for start in range(0, len(vectors), BLOCK_SIZE):
+        block = numpy.asarray(vectors[start:start + BLOCK_SIZE], dtype=numpy.float32)
+        lists[start:start + BLOCK_SIZE] = block.dot(centroids.T).argmax(axis=1)
+    return lists
+
+def train(vectors, nlist, seed=0):
+    '''
+    Spherical k-means over a sample of vectors
+
+    Return:
+    * Matrix of nlist normalized centroids
+    '''
+    random = numpy.random.RandomState(seed)
+    size = min(len(vectors), nlist * TRAIN_PER_LIST)
+    sample = numpy.asarray(vectors[numpy.sort(random.choice(len(vectors), size, replace=False))], dtype=numpy.float32)
+    centroids = sample[random.choice(size, nlist, replace=False)].copy()
+
+    for _ in range(ITERATIONS):
+        lists = sample.dot(centroids.T).argmax(axis=1)
+        sums = numpy.zeros_like(centroids)
+        numpy.add.at(sums, lists, sample)
+        empty = numpy.bincount(lists, minlength=nlist) == 0
+        sums[empty] = sample[random.choice(size, empty.sum())] # Reseeds empty lists
+        norms = numpy.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        centroids = sums / norms
+
+    return centroids
+
+class IVFIndex:
+    '''
+    Inverted file index over a matrix of normalized vectors
+
+    Methods:
+    * IVFIndex.build(vectors) - Partitions vectors
+    * search(vectors, queries, k) - (ids, scores) of the k nearest vectors of each query
+    * save(path), IVFIndex.load(path) - Stores index in .npz file
+
+    Attributes:
+    * nprobe - Lists scored per query (recall vs latency)
+    * centroids - List centroids, or None for exact search
+    * order, offsets - Vector ids of list i are order[offsets[i]:offsets[i + 1]]
+    '''
+
+    def __init__(self, size, centroids=None, order=None, offsets=None, nprobe=None):
+        self.size = size
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, vectors, nlist=None, nprobe=None, seed=0):
+        '''
+        Arguments:
+        * vectors - Normalized vectors, one per row
+        * nlist - Number of lists (default sqrt(len(vectors)))
+        * nprobe - Default lists scored per query (default
+          NPROBE_SHARE of nlist)
+        '''
+        if len(vectors) < EXACT_THRESHOLD:
+            return cls(len(vectors), nprobe=nprobe)
+
+        if nlist is None:
+            nlist = int(numpy.sqrt(len(vectors)))
+        nlist = max(1, min(nlist, len(vectors)))
+
+        if nprobe is None:
+            nprobe = max(1, int(round(nlist * NPROBE_SHARE)))
+
+        centroids = train(vectors, nlist, seed)
+        lists = assign(vectors, centroids)
+        order = numpy.argsort(lists, kind="stable")
+        offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(lists, minlength=nlist))))
+        return cls(len(vectors), centroids, order, offsets, nprobe)
+
+    @property
+    def exact(self):
+        return self.centroids is None
+
+    def search(self, vectors, queries, k, nprobe=None, scales=None):
+        '''
+        Arguments:
+        * vectors - Matrix the index was built from
+        * queries - Normalized query vectors, one per row
+        * k - Number of neighbors
+        * nprobe - Lists scored per query (default self.nprobe)
+        * scales - Per-row scale factors of quantized vectors
+
+        Return:
+        * List of (ids, scores) arrays, one per query, best first
+        '''
+        if len(vectors) != self.size:
+            raise ValueError("Index was built for " + str(self.size) + " vectors, not " + str(len(vectors)))
+        queries = numpy.asarray(queries, dtype=numpy.float32)
+        if self.exact:
+            return exact_search(vectors, queries, k, scales)
+
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        coarse = queries.dot(self.centroids.T)
+        probes = numpy.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        if len(queries) <= SMALL_BATCH:
+            # Few queries: score each one's candidates in one go
+            results = []
+            for (query, probe) in zip(queries, probes):
+                ids = numpy.sort(numpy.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in probe]))
+                scores = numpy.asarray(vectors[ids], dtype=numpy.float32).dot(query)
+                if scales is not None:
+                    scores *= scales[ids]
+                best = top_k(scores, k)
+                results.append((ids[best], scores[best]))
+            return results
+
+        # Best k of each probed list for each query; slot j * k of a
+        # query's row holds the results of its j-th probed list
+        candidate_ids = numpy.full((len(queries), nprobe * k), -1, dtype=numpy.int64)
+        candidate_scores = numpy.full((len(queries), nprobe * k), -numpy.inf, dtype=numpy.float32)
+
+        # Groups (query, j) pairs by probed list
+        pairs = numpy.argsort(probes, axis=None, kind="stable")
+        lists = probes.ravel()[pairs]
+        bounds = numpy.flatnonzero(numpy.diff(lists)) + 1
+        for group in numpy.split(pairs, bounds):
+            i = probes.ravel()[group[0]]
+            ids = numpy.sort(self.order[self.offsets[i]:self.offsets[i + 1]]) # Reads rows of memory-mapped vectors in order
+            if len(ids) == 0:
+                continue
+            (rows, slots) = numpy.divmod(group, nprobe)
+            block = numpy.asarray(vectors[ids], dtype=numpy.float32)
+            scores = queries[rows].dot(block.T)
+            if scales is not None:
+                scores *= scales[ids]
+
+            top = min(k, len(ids))
+            if top < len(ids):
+                best = numpy.argpartition(-scores, top - 1, axis=1)[:, :top]
+            else:
+                best = numpy.broadcast_to(numpy.arange(top), (len(rows), top))
+            columns = slots[:, None] * k + numpy.arange(top)
+            candidate_ids[rows[:, None], columns] = ids[best]
+            candidate_scores[rows[:, None], columns] = numpy.take_along_axis(scores, best, axis=1)
+
+        results = []
+        for (ids, scores) in zip(candidate_ids, candidate_scores):
+            best = top_k(scores, k)
+            best = best[ids[best] >= 0]
+            results.append((ids[best], scores[best]))
+        return results
+
+    def save(self, path):
+        '''
+        Saves index to path (.npz appended if missing, as by numpy.savez)
+        '''
+        if self.exact:
+            numpy.savez(npz_path(path), size=self.size, nprobe=self.nprobe or 0)
+        else:
+            numpy.savez(npz_path(path), size=self.size, nprobe=self.nprobe, centroids=self.centroids, order=self.order, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path):
+        with numpy.load(npz_path(path)) as data:
+            if "centroids" in data:
+                return cls(int(data["size"]), data["centroids"], data["order"], data["offsets"], int(data["nprobe"]))
+            return cls(int(data["size"]), nprobe=int(data["nprobe"]) or None)
+
+def npz_path(path):
+    return path if path.endswith(".npz") else path + ".npz"
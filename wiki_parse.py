@@ -1,31 +1,92 @@
 # encoding: utf-8
 
-# grep -o "{{IPA|.*}}" enwiktionary-20180420-pages-articles.xml > grep.txt
+'''
+Extracts language/transcript pairs from {{IPA|...}} templates
+in English Wiktionary
+wiki_parse.py [--workers N] input output
+
+input is either the compressed dump, which is streamed directly:
+	enwiktionary-20180420-pages-articles.xml.bz2
+or the output of a previous grep pass over the uncompressed dump:
+	grep -o "{{IPA|.*}}" enwiktionary-20180420-pages-articles.xml > grep.txt
+Output format: One transcript per line
+	LANG⦀TRANSCRIPT
+
+With --workers N, plain text input is split into byte ranges aligned
+to line boundaries that are parsed in parallel, each into its own shard,
+and the shards are concatenated in order. Compressed dumps cannot be
+split, so they are decompressed in this process and batches of template
+lines are handed to the workers instead. Output is identical to a
+single-process run.
+'''
 
 import time
 import sys
-from collections import Counter
-import pickle
+from collections import Counter, deque
 import io
+import bz2
+import re
+import os
+import getopt
+import shutil
+import tempfile
+import multiprocessing
+
+import langstore
 
-INPUT = sys.argv[1]
-OUTPUT = sys.argv[2]
 DELIMITER = "⦀"
-NAMES = pickle.load(open("langs.pydict", "rb"))
+NAMES = None # Code -> name table of langs.store (built by namesdict.py), opened on first lookup
 
-start_time = time.time()
+IPA_TEMPLATE = re.compile(r"\{\{IPA\|.*\}\}") # Same (greedy) match as grep -o "{{IPA|.*}}"
+CHUNKS_PER_WORKER = 4 # Byte ranges per worker, evens out uneven chunks
+BATCH_SIZE = 10000 # Template lines per batch for compressed input
 
-r = io.open(INPUT, "r", encoding="utf-8")
-bad = 0
-lang_counts = Counter()
-data = []
+def language_name(code):
+	'''
+	Returns full name of language code (the code itself if
+	unknown), from the memory-mapped store; lookups are memoized,
+	so each process searches the store once per distinct code
+	'''
+	global NAMES
+	if NAMES is None:
+		NAMES = langstore.Store("langs.store").names
+	return NAMES.get(code, code)
+
+def open_input(path):
+	'''
+	Opens Wiktionary input for reading, decompressing
+	.bz2 dumps on the fly
+	'''
+	if path.endswith(".bz2"):
+		return bz2.open(path, "rt", encoding="utf-8")
+	return io.open(path, "r", encoding="utf-8")
+
+def ipa_lines(f):
+	'''
+	Yields the {{IPA|...}} portion of each line of f that
+	contains an IPA template, discarding everything else
+	(equivalent to grep -o "{{IPA|.*}}")
+	'''
+	for line in f:
+		if "{{IPA|" not in line:
+			continue
+		match = IPA_TEMPLATE.search(line)
+		if match:
+			yield match.group()
 
-for line in r:
-	print(line.encode('utf-8'))
+def parse_line(line):
+	'''
+	Extracts language code and transcripts from line of
+	{{IPA|...}} templates
+
+	Return:
+	* Triple (lang, transcripts, bad), where bad is the
+	number of rejected templates/lines
+	'''
 	lang = ""
 	transcripts = []
-	
-	string = line.split("{{")[1].split("}}")[0]
+	bad = 0
+
 	for string in line.split("{{"):
 		if "}}" not in string:
 			continue
@@ -48,19 +109,201 @@ for line in r:
 					transcripts.append(element[1:-1].replace("(", "").replace(")", ""))
 				else:
 					transcripts.append(element[1:-1])
-			
-	if lang == "":
-		bad += 1
-		continue
-	elif transcripts == []:
+
+	if lang == "" or transcripts == []:
 		bad += 1
-		continue
-	
-	for transcript in transcripts:
-		lang_counts[lang] += 1
-		lang_name = NAMES.get(lang, lang) # Full language name
-		data.append((transcript, NAMES.get(lang, lang)))
-						
-w = io.open(OUTPUT, "w", encoding="utf-8")
-for (transcript, lang) in data:
-	w.write(lang + DELIMITER + transcript + "\n")
+
+	return (lang, transcripts, bad)
+
+def extract(lines, w):
+	'''
+	Parses lines of IPA templates, writing each transcript
+	to w as it is found
+
+	Arguments:
+	* lines - Iterable of lines containing {{IPA|...}} templates
+	* w - Output file
+
+	Return:
+	* Pair (lang_counts, bad)
+	'''
+	bad = 0
+	lang_counts = Counter()
+
+	for line in lines:
+		(lang, transcripts, line_bad) = parse_line(line)
+		bad += line_bad
+		if lang == "" or transcripts == []:
+			continue
+
+		lang_name = language_name(lang) # Full language name
+		for transcript in transcripts:
+			lang_counts[lang] += 1
+			w.write(lang_name + DELIMITER + transcript + "\n")
+
+	return (lang_counts, bad)
+
+def line_ranges(path, n):
+	'''
+	Splits file into at most n byte ranges, each
+	beginning at the start of a line
+
+	Return:
+	* List of (start, end) offsets
+	'''
+	size = os.path.getsize(path)
+	bounds = [0]
+
+	with io.open(path, "rb") as f:
+		for i in range(1, n):
+			if i * size // n <= bounds[-1]:
+				continue
+			f.seek(i * size // n)
+			f.readline() # Moves to start of next line
+			if f.tell() >= size:
+				break
+			if f.tell() > bounds[-1]:
+				bounds.append(f.tell())
+
+	bounds.append(size)
+	return list(zip(bounds[:-1], bounds[1:]))
+
+class RangeReader(io.RawIOBase):
+	'''
+	Raw binary stream over byte range of open file, so the range
+	can be decoded (and split into lines) by io.TextIOWrapper
+	exactly as open_input() does for the whole file
+	'''
+
+	def __init__(self, f, start, end):
+		self.f = f
+		self.remaining = end - start
+		f.seek(start)
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		n = self.f.readinto(memoryview(b)[:self.remaining])
+		self.remaining -= n
+		return n
+
+def extract_range(args):
+	'''
+	Worker: parses byte range of input into shard file
+
+	Arguments:
+	* args - Tuple (input path, start, end, shard path)
+
+	Return:
+	* Pair (lang_counts, bad)
+	'''
+	(path, start, end, shard) = args
+
+	with io.open(path, "rb") as f, io.open(shard, "w", encoding="utf-8") as w:
+		# Universal newlines, as in the single-process path; ranges begin
+		# after "\n", so no "\r\n" is split between ranges
+		r = io.TextIOWrapper(io.BufferedReader(RangeReader(f, start, end)), encoding="utf-8")
+		return extract(ipa_lines(r), w)
+
+def extract_batch(lines):
+	'''
+	Worker: parses batch of template lines
+
+	Return:
+	* Triple (output text, lang_counts, bad)
+	'''
+	w = io.StringIO()
+	(lang_counts, bad) = extract(lines, w)
+	return (w.getvalue(), lang_counts, bad)
+
+def batches(lines, size):
+	'''
+	Groups iterable of lines into lists of at most size lines
+	'''
+	batch = []
+	for line in lines:
+		batch.append(line)
+		if len(batch) >= size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+def extract_parallel(path, w, workers):
+	'''
+	Parses input with pool of worker processes, writing
+	transcripts to w in input order
+
+	Return:
+	* Pair (lang_counts, bad)
+	'''
+	bad = 0
+	lang_counts = Counter()
+
+	with multiprocessing.Pool(workers) as pool:
+		if path.endswith(".bz2"):
+			# Compressed stream can't be split - decompress here, parse batches in workers
+			pending = deque()
+			with open_input(path) as r:
+				for batch in batches(ipa_lines(r), BATCH_SIZE):
+					pending.append(pool.apply_async(extract_batch, (batch,)))
+					while len(pending) > 2 * workers or (pending and pending[0].ready()):
+						(text, counts, batch_bad) = pending.popleft().get()
+						w.write(text)
+						lang_counts.update(counts)
+						bad += batch_bad
+			while pending:
+				(text, counts, batch_bad) = pending.popleft().get()
+				w.write(text)
+				lang_counts.update(counts)
+				bad += batch_bad
+		else:
+			# Plain text - parse line-aligned byte ranges into shards, concatenate in order
+			shard_dir = tempfile.mkdtemp(prefix="wiki_parse_")
+			try:
+				ranges = line_ranges(path, workers * CHUNKS_PER_WORKER)
+				shards = [os.path.join(shard_dir, str(i)) for i in range(len(ranges))]
+				results = pool.map(extract_range, [(path, start, end, shard) for ((start, end), shard) in zip(ranges, shards)])
+				for (shard, (counts, shard_bad)) in zip(shards, results):
+					with io.open(shard, "r", encoding="utf-8") as r:
+						shutil.copyfileobj(r, w)
+					lang_counts.update(counts)
+					bad += shard_bad
+			finally:
+				shutil.rmtree(shard_dir)
+
+	return (lang_counts, bad)
+
+if __name__ == "__main__":
+	USAGE = "wiki_parse.py [--workers N] input output"
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "w:", ["workers="])
+	except getopt.GetoptError:
+		print(USAGE)
+		sys.exit(1)
+	if len(args) != 2:
+		print(USAGE)
+		sys.exit()
+
+	WORKERS = 1
+	for opt, arg in opts:
+		if opt in ("-w", "--workers"):
+			WORKERS = int(arg)
+
+	INPUT = args[0]
+	OUTPUT = args[1]
+
+	start_time = time.time()
+
+	with io.open(OUTPUT, "w", encoding="utf-8") as w:
+		if WORKERS > 1:
+			(lang_counts, bad) = extract_parallel(INPUT, w, WORKERS)
+		else:
+			with open_input(INPUT) as r:
+				(lang_counts, bad) = extract(ipa_lines(r), w)
+
+	print("Transcripts:", sum(lang_counts.values()))
+	print("Languages:", len(lang_counts))
+	print("Bad:", bad)
+	print("Time:", round(time.time() - start_time, 2))
@@ -3,6 +3,12 @@
 #  - loading, cosine similarity, nearest neighbors
 #
 # modified to work with opennmt format
+#
+# wordvecutil.py -v <word_vectors_txt> [options] [command [args]]
+# commands: near, sim, families (default), cluster, plot (see USAGE)
+#
+# sklearn, joblib and matplotlib are only imported by cluster(),
+# plot() and the mds projection, so importing this module is cheap
 
 IE = {"Germanic", "Celtic", "Balto-Slavic", "Romance", "Indo-Iranian", "Indo-European Isolate"}
 
@@ -10,18 +16,24 @@ import numpy
 import sys
 import getopt
 import math
+import os
+import hashlib
+import time
 
-import sklearn.cluster
-import sklearn.manifold
-from matplotlib import pyplot
+import vecindex
+import langstore
 
-import pickle
 import collections
 
 NAMES = None
 FAMILIES = None
 COUNTS = None
 MIN_COUNT = 0
+PARSE_BLOCK = 4096 # Vectors parsed at a time when loading text files
+
+DTYPES = ("float32", "float16", "int8")
+CALIBRATION_RUNS = 5 # Timed searches when checking that an index is faster than exact search
+RESCORE_DEPTH = 4 # Candidates per neighbor rescored in float32 for float16/int8 vectors
 
 def fix_spaces(word):
 	return "".join([" " + c if c.isupper() and i != 0 and word[i - 1].isalpha() else c for i, c in enumerate(word)]).lstrip()
@@ -42,119 +54,385 @@ def generate_colors(n):
     rgb256 = [(230, 25, 75), (60, 180, 75), (0, 130, 200), (245, 130, 48), (145, 30, 180), (240, 50, 230), (210, 245, 60), (250, 190, 190), (0, 128, 128), (170, 110, 40), (128, 0, 0), (170, 255, 195), (70, 240, 240), (128, 128, 0), (0, 0, 128), (255, 215, 180), (230, 190, 255)][:n]
     return [(r/256, g/256, b/256) for (r, g, b) in rgb256]
 
+def block_mean(matrix, rows, columns):
+    '''
+    Returns mean of matrix[i, j] over rows i and columns j
+    selected by boolean masks, excluding the diagonal (i == j);
+    nan if there are no such pairs
+    '''
+    both = rows & columns
+    total = rows.dot(matrix).dot(columns) - matrix.diagonal()[both].sum()
+    count = rows.sum() * columns.sum() - both.sum()
+    return total / count if count > 0 else float("nan")
+
+def parse_vectors(fname):
+    '''
+    Parses word vectors in text format (Word2Vec, with a
+    "count dim" header line, or OpenNMT, without) in one pass,
+    PARSE_BLOCK rows at a time into float32 blocks that are
+    concatenated at the end
+
+    Return:
+    * Pair (list of words, normalized float32 matrix)
+    '''
+    words = []
+    blocks = []
+    block = []
+    dim = None
+
+    def parse_block():
+        # parse a block of vectors at once
+        values = numpy.fromstring(" ".join(block), dtype=numpy.float32, sep=" ")
+        if values.size != len(block) * dim:
+            raise ValueError("Vectors in " + fname + " have inconsistent dimensions")
+        values = values.reshape(len(block), dim)
+
+        # normalize the vectors
+        norms = numpy.linalg.norm(values, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        values /= norms
+        blocks.append(values)
+        del block[:]
+
+    with open(fname) as f:
+        for i, line in enumerate(f):
+            if i == 0:
+                toks = line.split()
+                if len(toks) == 2 and toks[0].isdigit() and toks[1].isdigit(): # Word2Vec Format
+                    continue
+            if not line.strip():
+                continue
+            word, _, vecstr = line.rstrip("\n").partition(' ')
+            if dim is None:
+                dim = len(vecstr.split())
+            words.append(fix_spaces(word)) # Fix removal of spaces
+            block.append(vecstr)
+            if len(block) >= PARSE_BLOCK:
+                parse_block()
+    if block:
+        parse_block()
+
+    if not blocks:
+        raise ValueError("No vectors in " + fname)
+    vecs = blocks[0] if len(blocks) == 1 else numpy.concatenate(blocks)
+    return words, vecs
+
+def cache_paths(fname):
+    return fname + ".npy", fname + ".vocab"
+
+def read_cache(fname):
+    '''
+    Returns (words, memory-mapped vectors) from cache of
+    fname, or None if there is no cache newer than fname
+    '''
+    matrix_path, vocab_path = cache_paths(fname)
+    try:
+        mtime = os.path.getmtime(fname)
+        if os.path.getmtime(matrix_path) < mtime or os.path.getmtime(vocab_path) < mtime:
+            return None
+        with open(vocab_path, encoding="utf-8", newline="\n") as f:
+            words = [line[:-1] for line in f]
+        vecs = numpy.load(matrix_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if len(words) != vecs.shape[0]:
+        return None
+    return words, vecs
+
+def write_cache(fname, words, vecs):
+    '''
+    Writes words and vectors to cache of fname (ignored
+    if the directory is not writable)
+    '''
+    matrix_path, vocab_path = cache_paths(fname)
+    try:
+        numpy.save(matrix_path, vecs)
+        with open(vocab_path, "w", encoding="utf-8", newline="\n") as f:
+            for word in words:
+                f.write(word + "\n")
+    except OSError:
+        pass
+
+def quantize(vecs):
+    '''
+    Quantizes rows of vecs to int8 with per-row scale
+    factors (row ~= int8 row * scale)
+
+    Return:
+    * Pair (int8 matrix, float32 scales)
+    '''
+    quantized = numpy.empty(vecs.shape, dtype=numpy.int8)
+    scales = numpy.empty(len(vecs), dtype=numpy.float32)
+    for start in range(0, len(vecs), vecindex.BLOCK_SIZE):
+        block = numpy.asarray(vecs[start:start + vecindex.BLOCK_SIZE], dtype=numpy.float32)
+        block_scales = numpy.abs(block).max(axis=1) / 127
+        block_scales[block_scales == 0] = 1
+        quantized[start:start + vecindex.BLOCK_SIZE] = numpy.rint(block / block_scales[:, None])
+        scales[start:start + vecindex.BLOCK_SIZE] = block_scales
+    return quantized, scales
+
+def project_mds(vecs):
+    import sklearn.manifold
+    return sklearn.manifold.MDS().fit_transform(vecs)
+
+def project_pca(vecs):
+    centered = vecs - vecs.mean(axis=0)
+    _, _, components = numpy.linalg.svd(centered, full_matrices=False)
+    return centered.dot(components[:2].T)
+
+def project_landmark(vecs, landmarks = None, seed = None):
+    '''
+    Landmark MDS: classical MDS on a random sample of
+    landmarks, then every vector placed by its squared
+    distances to the landmarks
+    '''
+    if landmarks is None:
+        landmarks = LANDMARKS
+    if seed is None:
+        seed = LANDMARK_SEED
+    landmarks = min(landmarks, len(vecs))
+    chosen = numpy.sort(numpy.random.RandomState(seed).choice(len(vecs), landmarks, replace=False))
+    marks = vecs[chosen]
+    
+    def squared_distances(block):
+        return (block ** 2).sum(axis=1)[:, None] + (marks ** 2).sum(axis=1)[None, :] - 2 * block.dot(marks.T)
+    
+    # Classical MDS on the landmarks
+    marks_distances = squared_distances(marks)
+    centering = numpy.eye(landmarks) - 1 / landmarks
+    values, eigenvectors = numpy.linalg.eigh(-0.5 * centering.dot(marks_distances).dot(centering))
+    top = numpy.argsort(values)[::-1][:2]
+    values = numpy.maximum(values[top], 1e-12)
+    pseudoinverse = eigenvectors[:, top] / numpy.sqrt(values)
+    mean = marks_distances.mean(axis=0)
+    
+    # Place all vectors relative to the landmarks
+    points = numpy.empty((len(vecs), 2), dtype=numpy.float64)
+    for start in range(0, len(vecs), vecindex.BLOCK_SIZE):
+        block = vecs[start:start + vecindex.BLOCK_SIZE]
+        points[start:start + vecindex.BLOCK_SIZE] = -0.5 * (squared_distances(block) - mean).dot(pseudoinverse)
+    return points
+
+PROJECTIONS = {"mds": project_mds, "landmark": project_landmark, "pca": project_pca}
+LANDMARKS = 500 # Landmarks for landmark MDS
+LANDMARK_SEED = 0 # Seed for choosing the landmarks
+
+Clustering = collections.namedtuple("Clustering", ["groups", "membership", "inertia", "centroids"])
+
+def fit_kmeans(vecs, k, init, seed):
+    '''
+    Single k-means run (one restart of word_vectors.cluster())
+    '''
+    import sklearn.cluster
+    return sklearn.cluster.KMeans(n_clusters=k, init=init, n_init=1, random_state=seed).fit(vecs)
+
 class word_vectors:
 
     # fname: the file containing word vectors in text format
     # maxtypes: the maximum size of the vocabulary
+    # dtype: storage of the vectors (see load_vectors)
+    # quiet: don't print what was loaded
 
-    def __init__(self, fname, maxtypes=0):
+    def __init__(self, fname, maxtypes=0, dtype="float32", quiet=False):
         self.word2idx = {}
         self.idx2word = []
         self.numtypes = 0
         self.dim = 0
-        self.v = self.load_vectors(fname, maxtypes)
+        self.index = None
+        self.scales = None
+        self.source = None
+        self.rows = None
+        self.fname = fname
+        self.projections = {}
+        self.v = self.load_vectors(fname, maxtypes, dtype, quiet)
+
+    # build_index builds an approximate nearest-neighbor index
+    # used by near() and analogy()
+    # nlist: number of inverted lists (default sqrt of vocabulary size)
+    # nprobe: lists searched per query; higher = better recall, slower
+    #         (default vecindex.NPROBE_SHARE of the lists)
+    # batch: typical number of queries per call, used to check
+    #        that the index is faster than exact search
+    #
+    # returns the index, or None (exact search) if it gives no speedup
+
+    def build_index(self, nlist = None, nprobe = None, batch = 1):
+        # scaling a row doesn't change its closest centroid,
+        # so quantized rows are partitioned as they are
+        return self.use_index(vecindex.IVFIndex.build(self.v, nlist, nprobe), batch)
+
+    # load_index loads an index saved with self.index.save(path)
+
+    def load_index(self, path, batch = 1):
+        return self.use_index(vecindex.IVFIndex.load(path), batch)
+
+    # use_index keeps the index only if searching batches of
+    # batch of our own vectors with it beats exact search
+
+    def use_index(self, index, batch = 1):
+        self.index = None
+        if index.exact:
+            return None
+
+        rows = numpy.random.RandomState(0).choice(len(self.idx2word), min(batch, len(self.idx2word)), replace=False)
+        queries = self.exact(numpy.sort(rows))
+        timings = []
+        for search in (lambda: vecindex.exact_search(self.v, queries, 10, self.scales),
+                       lambda: index.search(self.v, queries, 10, scales=self.scales)):
+            search() # warm up
+            start = time.perf_counter()
+            for i in range(CALIBRATION_RUNS):
+                search()
+            timings.append(time.perf_counter() - start)
+
+        if timings[1] < timings[0]:
+            self.index = index
+        return self.index
 
     # load vectors from a file in text format
     # fname: the file name
-    
-    def load_vectors(self, fname, max=0):
-        cnt = 0
-        with open(fname) as f:
-            toks = f.readline().split()
-
-            ##
-            try: # Word2Vec Format
-                if len(toks) != 2:
-                    raise Exception
-                numtypes = int(toks[0])
-                dim = int(toks[1])
-                
-            except: # OpenNMT Format
-                f.seek(0) # Returns to start of file
-                dim = len(toks) - 1
-                if COUNTS is not None:
-                    numtypes = sum(1 for line in f if not COUNTS[fix_spaces(line.split()[0])] < MIN_COUNT) # Counts lines in file, ignores vectors w/ below-min freq
-                else:
-                    numtypes = sum(1 for line in f)
-                    
-                print("Counted", numtypes, "types,", dim, "dimesions.")
-                f.seek(0) # Returns to start of file
-            ##
-            
-            if max > 0 and max < numtypes:
-                numtypes = max
-
-            # initialize the vectors as a two dimensional
-            # numpy array. 
-            vecs = numpy.zeros((numtypes, dim), dtype=numpy.float16)
-
-            # go through the file line by line
-            for line in f:
-                # get the word and the vector as a string
-                word, vecstr = line.split(' ', 1)
-                vecstr = vecstr.rstrip()
-                
-                # Fix removal of spaces
-                word = fix_spaces(word)
-                
-                # excludes words below minimum count
-                if COUNTS is not None and COUNTS[word] < MIN_COUNT:
-                    continue
-                    
-                # excludes words not in families
-                #if not (word in FAMILIES["Germanic"] or word in FAMILIES["Celtic"] or word in FAMILIES["Balto-Slavic"] or word in FAMILIES["Romance"]):
-                #	continue
-
-                # now make the vector a numpy array
-                vec = numpy.fromstring(vecstr, numpy.float16, sep=' ')
-
-                # add the normalized vector
-                norm = numpy.linalg.norm(vec, ord=None)
-                vecs[cnt] = vec/norm
-
-                # index the word
-                if not NAMES:
-                    self.word2idx[word] = cnt
-                    self.idx2word.append(word)
-                else:
-                    self.word2idx[NAMES[word]] = cnt
-                    self.idx2word.append(NAMES[word])
-            
-                cnt += 1
-                if cnt >= numtypes:
-                    break
-            
+    #
+    # dtype: how the vectors are stored
+    #   float32 - exact; the memory-mapped cache is used as it is
+    #   float16 - half the memory
+    #   int8 - a quarter of the memory, with per-row scales
+    #
+    # the parsed, normalized vectors are cached next to the file
+    # (fname.npy + fname.vocab) and memory-mapped on later loads.
+    # for float16/int8, the float32 cache (self.source) is kept
+    # memory-mapped to rescore neighbor candidates
+
+    def load_vectors(self, fname, max=0, dtype="float32", quiet=False):
+        if dtype not in DTYPES:
+            raise ValueError("dtype must be one of " + ", ".join(DTYPES))
+
+        cached = read_cache(fname)
+        if cached is None:
+            words, vecs = parse_vectors(fname)
+            write_cache(fname, words, vecs)
+            cached = read_cache(fname) # memory-map the new cache
+        if cached is not None:
+            words, vecs = cached
+            self.source = vecs
+
+        # excludes words below minimum count
+        if COUNTS is not None:
+            keep = [i for i, word in enumerate(words) if not COUNTS[word] < MIN_COUNT]
+            words = [words[i] for i in keep]
+            vecs = vecs[keep]
+            self.rows = numpy.array(keep, dtype=numpy.int64)
+
+        if max > 0 and max < len(words):
+            words = words[:max]
+            vecs = vecs[:max]
+            if self.rows is not None:
+                self.rows = self.rows[:max]
+
+        if not quiet:
+            print("Loaded", len(words), "types,", vecs.shape[1], "dimensions.")
+
+        # index the words
+        if NAMES:
+            words = [NAMES[word] for word in words]
+        self.idx2word = list(words)
+        self.word2idx = {word: i for i, word in enumerate(words)}
+        self.numtypes = len(words)
+        self.dim = vecs.shape[1]
+
+        if dtype == "float32":
+            self.source = None # vecs are exact already
+            return vecs
+        if dtype == "float16":
+            return vecs.astype(numpy.float16)
+        vecs, self.scales = quantize(vecs)
+        return vecs
+
+    # exact returns float32 vectors of the given word indices,
+    # from the float32 cache when our vectors are float16/int8
+
+    def exact(self, ids):
+        if self.source is not None:
+            return numpy.asarray(self.source[ids if self.rows is None else self.rows[ids]], dtype=numpy.float32)
+        vecs = numpy.asarray(self.v[ids], dtype=numpy.float32)
+        if self.scales is not None:
+            vecs *= self.scales[ids][..., None]
         return vecs
 
+    # dense returns all vectors as a float32 matrix
+
+    def dense(self):
+        if self.v.dtype == numpy.float32:
+            return self.v
+        return self.exact(numpy.arange(len(self.idx2word)))
+
     # near gets the nearest neighbors of a word
     # target: target word or numpy array
     # numnear: number of nearest neighbors
 
     def near(self, target, numnear = 10):
+        return self.near_many([target], numnear)[0]
 
-        # check if string (instead of numpy array)
-        if type(target) is str:
-            # check if the word is in our index
-            if target in self.word2idx:
-                vector = self.v[self.word2idx[target]]
-            else:
-                return None
-        else: # numpy array
-            vector = target
-            norm = numpy.linalg.norm(vector, ord=None)
-            vector /= norm
-
-        # get the distance to all the words we know.
-        dist = self.v.dot(vector)
-
-        # sort by distance
-        near = sorted([(dist[i], self.idx2word[i]) for i in range(len(dist))], reverse=True)
-
-        # trim results and return
-        if numnear > len(near):
-            numnear = len(near)
-            
-        return near[0:numnear]
+    # near_many gets the nearest neighbors of several targets
+    # with one matrix multiply
+    # targets: list of words and/or numpy arrays, or a matrix
+    #          with one query vector per row
+    # numnear: number of nearest neighbors
+    #
+    # returns one list of (similarity, word) pairs per target,
+    # or None for words not in our index
+
+    def near_many(self, targets, numnear = 10):
+        queries, found = self.query_matrix(targets)
+        if queries.shape[0] == 0:
+            return [None] * len(found)
+
+        # get the numnear closest of the words we know, best first,
+        # through the index if there is one
+        depth = numnear if self.v.dtype == numpy.float32 else numnear * RESCORE_DEPTH
+        if self.index is not None:
+            hits = self.index.search(self.v, queries, depth, scales=self.scales)
+        else:
+            hits = vecindex.exact_search(self.v, queries, depth, self.scales)
+
+        # rescore candidates from float16/int8 vectors in float32
+        if depth != numnear:
+            for i, (ids, _) in enumerate(hits):
+                scores = self.exact(ids).dot(queries[i])
+                best = vecindex.top_k(scores, numnear)
+                hits[i] = (ids[best], scores[best])
+
+        return [None if row is None else
+                [(score, self.idx2word[i]) for i, score in zip(hits[row][0].tolist(), hits[row][1])]
+                for row in found]
+
+    # query_matrix builds a matrix of normalized query vectors
+    # returns the matrix and, for each target, its row in the
+    # matrix (None for words not in our index)
+
+    def query_matrix(self, targets):
+        if isinstance(targets, numpy.ndarray) and targets.ndim == 2:
+            rows = targets.astype(numpy.float32)
+            found = list(range(len(rows)))
+        else:
+            rows = []
+            found = []
+            for target in targets:
+                # check if string (instead of numpy array)
+                if type(target) is str:
+                    # check if the word is in our index
+                    if target in self.word2idx:
+                        found.append(len(rows))
+                        rows.append(self.exact(self.word2idx[target]))
+                    else:
+                        found.append(None)
+                else: # numpy array
+                    found.append(len(rows))
+                    rows.append(target)
+            rows = numpy.array(rows, dtype=numpy.float32).reshape(len(rows), self.dim)
+
+        norms = numpy.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return rows / norms, found
 
     # sim returns the cosine similarity between two words.
     # because our vectors are normalized, we can just
@@ -165,7 +443,23 @@ class word_vectors:
             return None
         if not w2 in self.word2idx:
             return None
-        return self.v[self.word2idx[w1]].dot(self.v[self.word2idx[w2]])
+        return self.exact(self.word2idx[w1]).dot(self.exact(self.word2idx[w2]))
+
+    # similarity_matrix returns the cosine similarity between
+    # every pair of words (row/column i = idx2word[i])
+    # with a single matrix multiply
+
+    def similarity_matrix(self):
+        vecs = self.dense()
+        return vecs.dot(vecs.T)
+
+    # mask returns a boolean index over our words that is
+    # True for each of the given words we know
+
+    def mask(self, words):
+        mask = numpy.zeros(len(self.idx2word), dtype=bool)
+        mask[[self.word2idx[word] for word in words if word in self.word2idx]] = True
+        return mask
         
         
     def analogy(self, positive, negative, n = 10):
@@ -180,79 +474,177 @@ class word_vectors:
     	Return:
     	* vector info
     	'''
+    	return self.analogy_many([(positive, negative)], n)[0]
+    
+    def analogy_many(self, queries, n = 10):
+    	'''
+    	Answers several analogies with one matrix multiply
+    	(see analogy())
     	
-    	# Get Σpositive - Σnegative
-    	difference = sum([self.v[self.word2idx[w]] for w in positive]) - sum([self.v[self.word2idx[w]] for w in negative])
+    	Arguments:
+    	* queries - list of (positive, negative) pairs of word lists
     	
-    	return self.near(difference, n)
-    
+    	Return:
+    	* list of vector info, one per query
+    	'''
+    	
+    	# Get Σpositive - Σnegative for each query
+    	differences = numpy.zeros((len(queries), self.dim), dtype=numpy.float32)
+    	for i, (positive, negative) in enumerate(queries):
+    		for w in positive:
+    			differences[i] += self.exact(self.word2idx[w])
+    		for w in negative:
+    			differences[i] -= self.exact(self.word2idx[w])
+    	
+    	return self.near_many(differences, n)
     
-    def cluster(self, k, centroids = None):
     
+    def cluster(self, k, centroids = None, n_init = 200, jobs = -1, minibatch = False, batch_size = 1024, plot = False):
+        '''
+        Clusters the vectors with k-means
+        
+        Arguments:
+        * k - number of clusters
+        * centroids - list of words to start from (one run)
+        * n_init - number of k-means++ restarts; the best is kept
+        * jobs - processes for restarts (-1 = all cores)
+        * minibatch - use MiniBatchKMeans (for large vocabularies)
+        * plot - plot the clusters (see plot())
+        
+        Return:
+        * Clustering(groups, membership, inertia, centroids), where
+        groups is a list of the words in each cluster
+        '''
+        import sklearn.cluster
+        import joblib
+        
+        vecs = self.dense()
+        
         # Get centroids
         if centroids is not None:
-            init = numpy.array([self.v[self.word2idx[word]] for word in centroids])
+            init = self.exact([self.word2idx[word] for word in centroids])
             n_init = 1
         else:
             init = "k-means++"
-            n_init = 200
         
-        kmeans = sklearn.cluster.KMeans(n_clusters=k, init=init, n_init=n_init)
+        if minibatch:
+            kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=k, init=init, n_init=n_init, batch_size=batch_size).fit(vecs)
+        elif n_init == 1:
+            kmeans = fit_kmeans(vecs, k, init, None)
+        else:
+            # Independent restarts in parallel; keep the lowest inertia
+            seeds = numpy.random.randint(numpy.iinfo(numpy.int32).max, size=n_init)
+            runs = joblib.Parallel(n_jobs=jobs)(joblib.delayed(fit_kmeans)(vecs, k, init, seed) for seed in seeds)
+            kmeans = min(runs, key=lambda run: run.inertia_)
         
-        # Compute clusters; membership = list of corresponding cluster IDs
-        membership = kmeans.fit_predict(v.v)
+        # membership = array of corresponding cluster IDs
+        membership = kmeans.labels_
         
-        # Plot clusters
-        self.plot(membership)
+        if plot:
+            self.plot(membership)
         
         # Build list of lists of vector labels within each cluster
-        return [
-            [self.idx2word[i] for i in range(len(membership)) if membership[i] == cluster]
-            for cluster in range(k)]
+        groups = [[] for cluster in range(k)]
+        for word, cluster in zip(self.idx2word, membership.tolist()):
+            groups[cluster].append(word)
+        
+        return Clustering(groups, membership, kmeans.inertia_, kmeans.cluster_centers_)
     
-    def plot(self, groups = []):
-                
-            
-        mds = sklearn.manifold.MDS()
+    def project(self, method = "mds"):
+        '''
+        Projects the vectors to 2-D
+        
+        Arguments:
+        * method - one of PROJECTIONS:
+            mds - metric MDS (slow, O(n²) memory)
+            landmark - classical MDS on LANDMARKS words, others placed
+                       relative to them (large vocabularies)
+            pca - first two principal components (fastest)
+        
+        Projections are cached in memory and next to the vector
+        file, keyed by a hash of the matrix, the method and, for
+        landmark, LANDMARKS and LANDMARK_SEED
+        
+        Return:
+        * n x 2 array of points (row i = idx2word[i])
+        '''
+        if method not in PROJECTIONS:
+            raise ValueError("method must be one of " + ", ".join(PROJECTIONS))
+        
+        vecs = self.dense()
+        # parameters of the method are part of the key
+        name = method
+        if method == "landmark":
+            name += "-" + str(min(LANDMARKS, len(vecs))) + "-" + str(LANDMARK_SEED)
+        key = (hashlib.blake2b(numpy.ascontiguousarray(vecs).data, digest_size=8).hexdigest(), name)
+        if key in self.projections:
+            return self.projections[key]
+        
+        path = self.fname + "." + key[1] + "." + key[0] + ".npy"
+        try:
+            points = numpy.load(path)
+        except (OSError, ValueError):
+            points = PROJECTIONS[method](vecs)
+            try:
+                numpy.save(path, points)
+            except OSError:
+                pass
+        
+        self.projections[key] = points
+        return points
+    
+    def plot(self, groups = None, method = "mds", path = None, labels = True):
+        '''
+        Plots the vectors in 2-D (see project()), coloured by
+        group (eg membership from cluster()), else by family
+        
+        Arguments:
+        * groups - group id of each vector
+        * method - projection method
+        * path - file to save to (.png, .svg, ...) instead of
+                 opening a window
+        * labels - label each point with its word
+        '''
+        import matplotlib
+        if path is not None and "matplotlib.pyplot" not in sys.modules:
+            matplotlib.use("Agg") # no display needed
+        from matplotlib import pyplot
         
         # Performs dimensional scaling
-        points = mds.fit_transform(self.v)
+        points = self.project(method)
         
-        if groups != []:
-            colors = generate_colors(max(groups) - min(groups) + 1)
-            color_list = [colors[group] for group in groups]
+        if groups is not None and len(groups) > 0:
+            groups = numpy.asarray(groups)
+            colors = numpy.array(generate_colors(groups.max() - groups.min() + 1))
+            color_list = colors[groups]
         elif FAMILIES: # Families -> colors
             families = [family for family in FAMILIES.keys() if len(FAMILIES[family]) > 1] # excludes 1-member families
             colors = generate_colors(len(FAMILIES))
             
-            color_list = []
-            for language in self.idx2word:
-                for i, family in enumerate(families):
-                    if language in FAMILIES[family]: # language in family
-                        color_list.append(colors[i])
-                        break
-                    if i == len(families) - 1: # none found
-                        color_list.append((0, 0, 0)) # No family found
+            # First family of each language
+            language_colors = {}
+            for i, family in enumerate(families):
+                for language in FAMILIES[family]:
+                    language_colors.setdefault(language, colors[i])
+            color_list = [language_colors.get(language, (0, 0, 0)) for language in self.idx2word] # (0, 0, 0): No family found
         else:
-            color_list = ["b"] * len(points)
-                        
+            color_list = "b"
+        
+        figure, axes = pyplot.subplots()
+        
         # Plots points
-        pyplot.scatter(
-            [x for [x, y] in points], # x positions
-            [y for [x, y] in points], # y positions
-            color=color_list # colors
-        )
-            
-            
+        axes.scatter(points[:, 0], points[:, 1], color=color_list)
         
         # Label each point with vector name
-        for i, point in enumerate(points):
-            pyplot.annotate(
-                self.idx2word[i], # Label
-                point # Coordinates
-            )
+        if labels:
+            for word, x, y in zip(self.idx2word, points[:, 0].tolist(), points[:, 1].tolist()):
+                axes.annotate(word, (x, y))
         
-        pyplot.show()
+        if path is None:
+            pyplot.show()
+        else:
+            figure.savefig(path)
+        pyplot.close(figure)
         
         return
     
@@ -279,59 +671,111 @@ class word_vectors:
         
         
 
+USAGE = """wordvecutil.py -v <word_vectors_txt> [options] [command [args]]
+options:
+  -n <langs.store>    use language names (see namesdict.py)
+  -f <langs.store>    use language families
+  -c <counts> -m <min_count>
+  -d <dtype>          float32 (default), float16 or int8
+  -k <n>              number of neighbors/clusters (default 10)
+  --method <method>   plot projection: mds (default), landmark or pca
+  --minibatch         cluster with MiniBatchKMeans
+commands:
+  near WORD...        nearest neighbors of each word
+  sim WORD1 WORD2     cosine similarity
+  families            mean similarity within/between IE families (default)
+  cluster             k-means clusters (-k) and their families
+  plot [OUTPUT]       2-D plot, saved to OUTPUT (.png, .svg) if given"""
+
+def command_near(v, args, options):
+    for word, near in zip(args, v.near_many(args, options["k"])):
+        print(word)
+        if near is None:
+            print("\tnot found")
+            continue
+        for dist, other in near:
+            print("\t" + other + "\t" + str(round(float(dist), 4)))
+
+def command_sim(v, args, options):
+    if len(args) != 2:
+        print(USAGE)
+        sys.exit(1)
+    print(v.sim(args[0], args[1]))
+
+def command_families(v, args, options):
+    sim = v.similarity_matrix()
+
+    # index masks of all IE langs and of each family
+    masks = {family: v.mask(FAMILIES[family]) for family in IE}
+    mask_ie = numpy.logical_or.reduce(list(masks.values()))
+
+    for family1 in IE:
+        for family2 in IE:
+            print(family1, family2, block_mean(sim, masks[family1], masks[family2]))
+
+    print("\n\nIE-IE:", block_mean(sim, mask_ie, mask_ie))
+    print("IE-NonIE:", block_mean(sim, mask_ie, ~mask_ie))
+
+def command_cluster(v, args, options):
+    clustering = v.cluster(options["k"], minibatch=options["minibatch"])
+    print("Inertia:", clustering.inertia)
+    for i, group in enumerate(clustering.groups):
+        print("Cluster", i, group)
+    if FAMILIES:
+        v.get_family_counts(clustering.groups)
+
+def command_plot(v, args, options):
+    v.plot(method=options["method"], path=args[0] if args else None)
+
+COMMANDS = {"near": command_near, "sim": command_sim, "families": command_families,
+            "cluster": command_cluster, "plot": command_plot}
+
 # a sample drive
-fname = ''
-try:
-    opts, args = getopt.getopt(sys.argv[1:], "hv:n:f:c:m:")
-except getopt.GetoptError:
-    print("word_vectors.py -v <word_vectors_txt>")
-    sys.exit(1)
-for opt, arg in opts:
-    if opt == '-h':
-        print("word_vectors.py -v <word_vectors_txt>")
+if __name__ == "__main__":
+    fname = ''
+    dtype = "float32"
+    options = {"k": 10, "method": "mds", "minibatch": False}
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hv:n:f:c:m:d:k:", ["method=", "minibatch"])
+    except getopt.GetoptError:
+        print(USAGE)
+        sys.exit(1)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE)
+            sys.exit()
+        elif opt == '-v':
+            fname = arg
+        elif opt == '-n':
+            NAMES = langstore.Store(arg).names # Mapped for the whole run; lookups memoized
+        elif opt == '-f':
+            FAMILIES = langstore.Store(arg).members
+        elif opt == '-c':
+            COUNTS = {fix_spaces(line.split("\t")[0]): int(line.split("\t")[1]) for line in open(arg, "r") if len(line.split("\t")) >= 2}
+        elif opt == '-m':
+            MIN_COUNT = int(arg)
+        elif opt == '-d':
+            dtype = arg
+        elif opt == '-k':
+            options["k"] = int(arg)
+        elif opt == '--method':
+            options["method"] = arg
+        elif opt == '--minibatch':
+            options["minibatch"] = True
+
+    command = args[0] if args else "families"
+    if fname == '' or command not in COMMANDS:
+        print(USAGE)
         sys.exit()
-    elif opt == '-v':
-        fname = arg
-    elif opt == '-n':
-        NAMES = pickle.load(open(arg, "rb"))
-    elif opt == '-f':
-        FAMILIES = pickle.load(open(arg, "rb"))
-    elif opt == '-c':
-        COUNTS = {fix_spaces(line.split("\t")[0]): int(line.split("\t")[1]) for line in open(arg, "r") if len(line.split("\t")) >= 2}
-    elif opt == '-m':
-        MIN_COUNT = int(arg)
-        
-
-if fname == '':
-    print("word_vectors.py -v <word_vectors_txt>")
-    sys.exit()
-
-print("Loading...")
-
-# create the vectors from a file in text format,
-# and load at most 100000 vectors
-v = word_vectors(fname, 100000)
-print("Done.")
-
-sim = collections.defaultdict(dict)
-
-for lang1 in v.idx2word:
-	for lang2 in v.idx2word:
-		if lang1 != lang2:
-			sim[lang1][lang2] = v.sim(lang1, lang2)
+    if command == "families" and not FAMILIES:
+        print("families requires -f <langs.store>")
+        sys.exit(1)
 
-# set of all IE langs
-langs_ie = set.union(*[FAMILIES[family] for family in IE])
+    print("Loading...")
 
-for family1 in IE:
-	for family2 in IE:
-		sims = [sim[lang1][lang2] for lang2 in FAMILIES[family2] for lang1 in FAMILIES[family1] if lang1 in v.idx2word and lang2 in v.idx2word and lang1 != lang2]
-		print(family1, family2, numpy.mean(sims))
-	#sims_ie = [sim[lang1][lang2] for lang2 in  
-	
-sims = [sim[lang1][lang2] for lang1 in langs_ie for lang2 in langs_ie if lang1 != lang2 and lang1 in v.idx2word and lang2 in v.idx2word]
-print("\n\nIE-IE:", numpy.mean(sims))
+    # create the vectors from a file in text format,
+    # and load at most 100000 vectors
+    v = word_vectors(fname, 100000, dtype)
+    print("Done.")
 
-sims = [sim[lang1][lang2] for lang1 in v.idx2word for lang2 in v.idx2word if lang1 != lang2 and lang1 in langs_ie and lang2 not in langs_ie]
-print("IE-NonIE:", numpy.mean(sims))
-	
+    COMMANDS[command](v, args[1:], options)